@@ -0,0 +1,273 @@
+import os, shutil, subprocess, sys, tempfile
+
+import pandas as pd
+from bokeh.embed import file_html
+from bokeh.layouts import gridplot
+from bokeh.resources import CDN
+
+from octoviz import common
+from octoviz.cache import cache_file, read_cache, write_cache, pulls_to_frame
+from octoviz.graph import data_to_graph_params, graph
+from octoviz.run import aggregate, build_frame
+from octoviz.sketch import build_sketch, merge_sketches, sketch_table
+from octoviz.store import store_file, read_store, write_store, upsert_store
+
+from .fake_github import FakeGithub, synthetic_columns, synthetic_pulls
+
+sizes = [1000, 10000, 100000, 1000000]
+percentiles = [25, 50, 90]
+repository = 'octoviz/synthetic'
+
+
+def synthetic_frame(count):
+    columns = synthetic_columns(count)
+    for column in ['created_at', 'closed_at', 'updated_at']:
+        columns[column] = columns[column].astype('datetime64[s]')
+
+    return pd.DataFrame(columns)
+
+
+def synthetic_aggregate(count, group='closed'):
+    frame = build_frame(synthetic_frame(count), group, 'week', 20)
+    if group not in {'closed', 'created'}:
+        frame = frame[frame[group] < 20 * 50]
+
+    return frame['lifetime'].groupby(frame[group])
+
+
+class TemporaryHome:
+    # Keep benchmark caches out of the real ~/.octoviz
+    def setup_home(self):
+        self.original_home = common.home_dir
+        common.home_dir = tempfile.mkdtemp()
+        common.create_directory('')
+
+    def teardown_home(self):
+        shutil.rmtree(common.home_dir, ignore_errors=True)
+        common.home_dir = self.original_home
+
+
+class Fetch(TemporaryHome):
+    params = ([1000, 10000], [False, True])
+    param_names = ['pulls', 'full']
+    timeout = 1200
+    backend = 'rest'
+
+    def setup(self, count, full=True):
+        self.setup_home()
+        self.github = FakeGithub(synthetic_pulls(count))
+        self.github.start()
+        common.prepare_clients(16)
+        common.profiles[:] = [{'name': 'benchmark', 'token': 'benchmark', 'url': self.github.url, 'backend': self.backend}]
+
+    def teardown(self, count, full=True):
+        self.github.stop()
+        self.teardown_home()
+
+    def fetch(self, full):
+        return pulls_to_frame(common.get_raw_pull_data(self.github.organization, self.github.repository, None, full, workers=8))
+
+    def time_get_raw_pull_data(self, count, full):
+        self.fetch(full)
+
+    def peakmem_get_raw_pull_data(self, count, full):
+        self.fetch(full)
+
+
+class GraphQLFetch(Fetch):
+    params = [1000, 10000]
+    param_names = ['pulls']
+    backend = 'graphql'
+
+    def time_get_raw_pull_data(self, count):
+        self.fetch(True)
+
+    def peakmem_get_raw_pull_data(self, count):
+        self.fetch(True)
+
+
+class Resilience(TemporaryHome):
+    # A server that fails every 7th request and runs out of budget every 200, so the scheduler has to retry, wait
+    # for the rate limit to reset and replay stored list pages; each check fails if any pull request goes missing
+    timeout = 600
+    count = 300
+
+    def setup(self):
+        self.setup_home()
+        self.github = FakeGithub(synthetic_pulls(self.count), fail_every=7, rate_limit=200, reset_after=2)
+        self.github.start()
+        common.prepare_clients(16)
+        common.adapter.backoff = 0.01  # Retried requests would otherwise wait a second each
+        common.profiles[:] = [{'name': 'benchmark', 'token': 'benchmark', 'url': self.github.url, 'backend': 'rest'}]
+
+    def teardown(self):
+        self.github.stop()
+        self.teardown_home()
+
+    def fetch(self):
+        pulls = pulls_to_frame(common.get_raw_pull_data(self.github.organization, self.github.repository, None, True, workers=8))
+        missing = set(pull['number'] for pull in self.github.pulls) - set(pulls['number'])
+        assert not missing, 'Pull requests dropped: %s' % sorted(missing)
+        assert (pulls['additions'] == [self.github.by_number[number]['additions'] for number in pulls['number']]).all()
+
+    def track_retried_requests(self):
+        self.fetch()
+        return self.github.requests // self.github.fail_every
+
+    def track_rate_limited_responses(self):
+        self.github.remaining['token benchmark'] = 0  # Spent by another client before this one has seen any headers
+        self.fetch()
+        assert self.github.rate_limited > 0, 'The server never refused a request'
+        return self.github.rate_limited
+
+    def track_not_modified(self):
+        self.fetch()
+        self.fetch()  # Every list page is unchanged, so the second pass gets them back as 304s
+        assert self.github.not_modified > 0, 'No stored list page was replayed'
+        return self.github.not_modified
+
+
+class Import:
+    # Each timing runs in a fresh interpreter, so it includes everything the CLI loads before parsing arguments
+    heavy = ['arrow', 'bokeh', 'github3', 'numpy', 'pandas', 'requests']
+
+    def timeraw_import_cli(self):
+        return 'import octoviz'
+
+    def timeraw_import_flush(self):
+        return 'import octoviz, octoviz.flush'
+
+    def timeraw_import_profile(self):
+        return 'import octoviz, octoviz.profile'
+
+    def timeraw_import_run(self):
+        return 'import octoviz, octoviz.run'
+
+    def track_heavy_imports_cli(self):
+        # Should stay at 0: profile and flush must not pay for the dependencies only run needs
+        code = 'import sys, octoviz, octoviz.flush, octoviz.profile; print(len({m.split(".")[0] for m in sys.modules} & set(%r)))'
+        return int(subprocess.check_output([sys.executable, '-c', code % self.heavy]))
+
+
+class Cache(TemporaryHome):
+    params = sizes
+    param_names = ['pulls']
+
+    def setup(self, count):
+        self.setup_home()
+        self.pull_data = synthetic_frame(count)
+        write_cache(repository, self.pull_data, True)
+
+    def teardown(self, count):
+        self.teardown_home()
+
+    def time_read_cache(self, count):
+        read_cache(repository)
+
+    def time_write_cache(self, count):
+        write_cache(repository, self.pull_data, True)
+
+    def track_cache_size(self, count):
+        return os.path.getsize(cache_file(repository))
+    track_cache_size.unit = 'bytes'
+
+
+class Store(TemporaryHome):
+    params = sizes[:3]
+    param_names = ['pulls']
+    timeout = 600
+
+    def setup(self, count):
+        self.setup_home()
+        self.pull_data = synthetic_frame(count)
+        write_store(repository, self.pull_data, True)
+        self.window = pd.Timestamp.utcnow() - pd.Timedelta(weeks=8)
+
+    def teardown(self, count):
+        self.teardown_home()
+
+    def time_read_store(self, count):
+        read_store(repository)
+
+    def time_read_store_window(self, count):
+        read_store(repository, self.window)
+
+    def time_upsert_store(self, count):
+        upsert_store(repository, self.pull_data.head(100))
+
+    def track_store_size(self, count):
+        return os.path.getsize(store_file())
+    track_store_size.unit = 'bytes'
+
+
+class Frame:
+    params = (sizes, ['closed', 'created', 'total'])
+    param_names = ['pulls', 'group']
+
+    def setup(self, count, group):
+        self.pull_data = synthetic_frame(count)
+
+    def time_build_frame(self, count, group):
+        build_frame(self.pull_data, group, 'week', 20)
+
+
+class Aggregate:
+    params = (sizes, ['closed', 'total'])
+    param_names = ['pulls', 'group']
+
+    def setup(self, count, group):
+        self.grouped = synthetic_aggregate(count, group)
+
+    def time_aggregate(self, count, group):
+        aggregate(self.grouped, percentiles)
+
+
+class Rollup:
+    # Combining repositories from their sketches, against concatenating their frames and aggregating the result
+    params = [10, 100]
+    param_names = ['repositories']
+
+    def setup(self, repositories):
+        self.frames = [build_frame(synthetic_frame(10000), 'closed', 'week', 20) for _ in range(repositories)]
+        self.sketches = [build_sketch(frame['lifetime'], frame['closed']) for frame in self.frames]
+
+    def time_build_sketch(self, repositories):
+        frame = self.frames[0]
+        build_sketch(frame['lifetime'], frame['closed'])
+
+    def time_merge_sketches(self, repositories):
+        sketch_table(merge_sketches(self.sketches), percentiles)
+
+    def time_concat_aggregate(self, repositories):
+        frame = pd.concat(self.frames, ignore_index=True)
+        aggregate(frame['lifetime'].groupby(frame['closed']), percentiles)
+
+
+class Render:
+    params = [1, 10, 40]
+    param_names = ['repositories']
+
+    def setup(self, repositories):
+        self.data = aggregate(synthetic_aggregate(10000), percentiles)
+        self.bar_width = 7 * 24 * 3600 * 800
+        self.line, self.bar = data_to_graph_params(self.data, self.bar_width, {'count': 'PRs Completed'}, True, 20)
+
+    def render(self, repositories, line=None, bar=None):
+        charts = [graph(line or self.line, bar or self.bar, 'synthetic', 'week', 'closed') for _ in range(repositories)]
+        return file_html(gridplot(charts), CDN)
+
+    def time_data_to_graph_params(self, repositories):
+        for _ in range(repositories):
+            data_to_graph_params(self.data, self.bar_width, {'count': 'PRs Completed'}, True, 20)
+
+    def time_render(self, repositories):
+        self.render(repositories)
+
+    def track_html_size(self, repositories):
+        return len(self.render(repositories))
+    track_html_size.unit = 'bytes'
+
+    def track_html_size_max_points(self, repositories):
+        line, bar = data_to_graph_params(self.data, self.bar_width, {'count': 'PRs Completed'}, True, 20, max_points=26)
+        return len(self.render(repositories, line, bar))
+    track_html_size_max_points.unit = 'bytes'
@@ -0,0 +1,250 @@
+import hashlib, json, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+# Keys github3 reads unconditionally when building its models; everything not given explicitly is stubbed
+user_keys = ['avatar_url', 'events_url', 'followers_url', 'following_url', 'gists_url', 'gravatar_id', 'html_url',
+    'organizations_url', 'received_events_url', 'repos_url', 'site_admin', 'starred_url', 'subscriptions_url', 'type']
+repo_keys = ['archive_url', 'assignees_url', 'blobs_url', 'branches_url', 'collaborators_url', 'comments_url', 'commits_url',
+    'compare_url', 'contents_url', 'contributors_url', 'deployments_url', 'description', 'downloads_url', 'events_url', 'fork',
+    'forks_url', 'git_commits_url', 'git_refs_url', 'git_tags_url', 'hooks_url', 'html_url', 'issue_comment_url',
+    'issue_events_url', 'issues_url', 'keys_url', 'labels_url', 'languages_url', 'merges_url', 'milestones_url',
+    'notifications_url', 'private', 'releases_url', 'stargazers_url', 'statuses_url', 'subscribers_url', 'subscription_url',
+    'tags_url', 'teams_url', 'trees_url', 'archived', 'clone_url', 'default_branch', 'forks_count', 'git_url', 'has_downloads',
+    'has_issues', 'has_pages', 'has_projects', 'has_wiki', 'homepage', 'language', 'mirror_url', 'network_count',
+    'open_issues_count', 'size', 'ssh_url', 'stargazers_count', 'subscribers_count', 'svn_url', 'watchers_count']
+pull_keys = ['active_lock_reason', 'assignee', 'body', 'body_html', 'body_text', 'comments_url', 'commits_url', 'diff_url',
+    'html_url', 'issue_url', 'locked', 'merge_commit_sha', 'patch_url', 'review_comment_url', 'review_comments_url',
+    'statuses_url', 'title']
+full_pull_keys = ['author_association', 'comments', 'commits', 'draft', 'mergeable', 'mergeable_state', 'merged', 'merged_by',
+    'review_comments']
+
+
+def stub(keys, **values):
+    result = {key: None for key in keys}
+    for key in keys:
+        if key.endswith('_url'):
+            result[key] = 'http://localhost/%s' % key
+        elif key.endswith('_count') or key in {'comments', 'commits', 'review_comments', 'size'}:
+            result[key] = 0
+    result.update(values)
+    return result
+
+
+def timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+def synthetic_columns(count, seed=0, span_days=730):
+    # Closed pull requests spread over the last `span_days`, newest first like the Github API returns them
+    rng = np.random.RandomState(seed)
+    now = int(time.time())
+    created = np.sort(rng.randint(now - span_days * 86400, now - 3600, size=count))[::-1]
+    closed = np.minimum(created + rng.exponential(3 * 86400, size=count).astype('int64') + 60, now)
+
+    return {
+        'number': np.arange(count, 0, -1, dtype='int64'),
+        'created_at': created,
+        'closed_at': closed,
+        'updated_at': np.minimum(closed + rng.randint(0, 3600, size=count), now),
+        'additions': rng.lognormal(4, 1.5, size=count).astype('int64'),
+        'deletions': rng.lognormal(3, 1.5, size=count).astype('int64'),
+    }
+
+
+def synthetic_pulls(count, seed=0, span_days=730):
+    columns = synthetic_columns(count, seed, span_days)
+
+    return [{
+        'number': int(columns['number'][i]),
+        'created_at': timestamp(columns['created_at'][i]),
+        'closed_at': timestamp(columns['closed_at'][i]),
+        'updated_at': timestamp(columns['updated_at'][i]),
+        'merged_at': timestamp(columns['closed_at'][i]),
+        'additions': int(columns['additions'][i]),
+        'deletions': int(columns['deletions'][i]),
+    } for i in range(count)]
+
+
+class FakeGithub:
+    # A small subset of the Github REST API v3, served the way a Github Enterprise server would (under /api/v3)
+    def __init__(self, pulls, organization='octoviz', repository='synthetic', latency=0, rate_limit=1000000, fail_every=0,
+            reset_after=3600):
+        self.pulls = pulls
+        self.by_number = {pull['number']: pull for pull in pulls}
+        self.organization = organization
+        self.repository = repository
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.reset_after = reset_after  # Seconds until every token's budget is restored
+        self.reset = time.time() + reset_after
+        self.remaining = {}  # Budget left for each token, by Authorization header
+        self.fail_every = fail_every  # Answer every Nth request with a 502, to exercise retries
+        self.requests = 0
+        self.not_modified = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.api = self.url + '/api/v3'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def repo_url(self):
+        return '%s/repos/%s/%s' % (self.api, self.organization, self.repository)
+
+    def user(self):
+        return stub(user_keys, login=self.organization, id=1, url='%s/users/%s' % (self.api, self.organization))
+
+    def repo(self):
+        url = self.repo_url()
+        return stub(repo_keys, id=1, name=self.repository, full_name='%s/%s' % (self.organization, self.repository), url=url,
+            owner=self.user(), pulls_url=url + '/pulls{/number}', created_at=timestamp(0), updated_at=timestamp(0),
+            pushed_at=timestamp(0))
+
+    def pull(self, pull, full):
+        destination = {'ref': 'master', 'label': 'master', 'sha': '0' * 40, 'user': self.user(), 'repo': self.repo()}
+        result = stub(pull_keys, url='%s/pulls/%d' % (self.repo_url(), pull['number']), id=pull['number'], number=pull['number'],
+            state='closed', user=self.user(), assignees=[], requested_reviewers=[], requested_teams=[], head=destination,
+            base=destination, _links={}, created_at=pull['created_at'], closed_at=pull['closed_at'],
+            updated_at=pull['updated_at'], merged_at=pull['merged_at'])
+        if full:
+            result.update(stub(full_pull_keys, additions=pull['additions'], deletions=pull['deletions']))
+        return result
+
+    def list_pulls(self, query):
+        pulls = self.pulls
+        if query.get('sort', ['created'])[0] == 'updated':
+            pulls = sorted(pulls, key=lambda x: x['updated_at'], reverse=True)
+        if query.get('direction', ['desc'])[0] == 'asc':
+            pulls = pulls[::-1]
+
+        per_page = int(query.get('per_page', [30])[0])
+        page = int(query.get('page', [1])[0])
+        body = [self.pull(pull, False) for pull in pulls[(page - 1) * per_page:page * per_page]]
+
+        links = None
+        if page * per_page < len(pulls):
+            query = dict(query, page=[page + 1], per_page=[per_page])
+            next_url = self.repo_url() + '/pulls?' + '&'.join('%s=%s' % (key, value[0]) for key, value in query.items())
+            links = '<%s>; rel="next"' % next_url
+        return body, links
+
+    def graphql(self, variables):
+        # Just enough of the GraphQL API to answer octoviz.graphql's pull request query
+        if (variables['owner'], variables['name']) != (self.organization, self.repository):
+            return {'data': {'repository': None}, 'errors': [{'message': 'Could not resolve to a Repository'}]}
+
+        pulls = self.pulls
+        if variables['order'] == 'UPDATED_AT':
+            pulls = sorted(pulls, key=lambda x: x['updated_at'], reverse=True)
+
+        start = int(variables['cursor'] or 0)
+        end = start + 100
+        nodes = [{
+            'number': pull['number'],
+            'createdAt': pull['created_at'],
+            'closedAt': pull['closed_at'],
+            'mergedAt': pull['merged_at'],
+            'updatedAt': pull['updated_at'],
+            'additions': pull['additions'],
+            'deletions': pull['deletions'],
+        } for pull in pulls[start:end]]
+        page_info = {'hasNextPage': end < len(pulls), 'endCursor': str(end)}
+
+        return {'data': {'repository': {'pullRequests': {'pageInfo': page_info, 'nodes': nodes}}}}
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+            def log_message(self, *args):
+                pass
+
+            def count_request(self):
+                with fake._lock:
+                    fake.requests += 1
+                    failed = fake.fail_every and fake.requests % fake.fail_every == 0
+                if fake.latency:
+                    time.sleep(fake.latency)
+                return not failed
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if not self.count_request():
+                    return self.respond(502, {'message': 'Server Error'})
+                if urlparse(self.path).path != '/api/graphql':
+                    return self.respond(404, {'message': 'Not Found'})
+
+                self.respond(200, fake.graphql(body['variables']))
+
+            def do_GET(self):
+                if not self.count_request():
+                    return self.respond(502, {'message': 'Server Error'})
+
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                path = url.path[len('/api/v3'):]
+                repo_path = '/repos/%s/%s' % (fake.organization, fake.repository)
+                links = None
+
+                if path == repo_path:
+                    body = fake.repo()
+                elif path == repo_path + '/pulls':
+                    body, links = fake.list_pulls(query)
+                elif re.match(re.escape(repo_path) + r'/pulls/\d+$', path) and int(path.rsplit('/', 1)[1]) in fake.by_number:
+                    body = fake.pull(fake.by_number[int(path.rsplit('/', 1)[1])], True)
+                else:
+                    return self.respond(404, {'message': 'Not Found'})
+
+                self.respond(200, body, links)
+
+            def respond(self, status, body, links=None):
+                payload = json.dumps(body).encode()
+                etag = '"%s"' % hashlib.sha1(payload).hexdigest()
+                token = self.headers.get('Authorization')
+                with fake._lock:
+                    if time.time() >= fake.reset:
+                        fake.remaining.clear()
+                        fake.reset = time.time() + fake.reset_after
+                    remaining = fake.remaining.get(token, fake.rate_limit)
+                    reset = fake.reset
+                    if status == 200 and remaining == 0:
+                        status, payload = 403, json.dumps({'message': 'API rate limit exceeded'}).encode()
+                        fake.rate_limited += 1
+                    if status == 200 and self.command == 'GET' and self.headers.get('If-None-Match') == etag:
+                        fake.not_modified += 1  # Conditional requests that match are free, like on Github
+                        status, payload = 304, b''
+                    elif status != 502:
+                        remaining = fake.remaining[token] = max(remaining - 1, 0)
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('X-RateLimit-Limit', str(fake.rate_limit))
+                self.send_header('X-RateLimit-Remaining', str(remaining))
+                self.send_header('X-RateLimit-Reset', str(int(reset)))
+                if status != 304:
+                    self.send_header('ETag', etag)
+                if links:
+                    self.send_header('Link', links)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
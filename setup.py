@@ -8,10 +8,16 @@ setup(
     package_dir={'':'src'},
     install_requires=[
         'github3.py',
+        'requests',
         'bokeh',
         'arrow',
-        'pandas'
+        'pandas',
+        'numpy'
     ],
+    extras_require={
+        'batch': ['pyyaml'],
+        'speedups': ['orjson'],
+    },
     version='1.3.1',
     entry_points='''
         [console_scripts]
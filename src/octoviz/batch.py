@@ -0,0 +1,101 @@
+import sys, json
+
+from octoviz.common import prepare_clients, octoviz_dir, create_directory
+from octoviz.cache import cache_exists
+from octoviz.store import store_exists
+from octoviz.budget import maintain_cache
+from octoviz.instrument import instrumentation, stage
+from octoviz.serve import Dashboards
+
+
+def read_manifest(path):
+    with open(path, 'r') as f:
+        text = f.read()
+
+    try:
+        import yaml
+    except ImportError:
+        try:
+            return json.loads(text)  # JSON manifests work without PyYAML
+        except ValueError:
+            sys.stderr.write('Reading YAML manifests requires PyYAML, install it with `pip install octoviz[batch]`\n')
+            sys.exit(1)
+
+    return yaml.safe_load(text)
+
+
+def dashboard_argv(dashboard, defaults):
+    # Every key is the long name of an `octoviz run` flag, except `repos`, the repositories to graph
+    options = dict(defaults, **dashboard)
+    argv = list(options.pop('repos'))
+    for name, value in options.items():
+        flag = '-%s' % name if len(name) == 1 else '--%s' % name
+        if value is True:
+            argv.append(flag)
+        elif isinstance(value, list):
+            argv += [flag, ','.join(str(x) for x in value)]
+        elif value is not False and value is not None:
+            argv += [flag, str(value)]
+
+    return argv
+
+
+def batch(args):
+    manifest = read_manifest(args.manifest)
+    defaults = manifest.get('defaults') or {}
+    dashboards = manifest.get('dashboards') or []
+
+    prepare_clients(args.pool_size or max(10, args.workers))
+    memory = Dashboards(args.full, args.store, args.workers)
+    exists = store_exists if args.store == 'sqlite' else cache_exists
+    repositories = list(dict.fromkeys(repository for dashboard in dashboards for repository in dashboard.get('repos') or []))
+    hits = {repository: exists(repository) for repository in repositories}
+
+    if args.refresh:
+        # Each repository is refreshed once, however many dashboards it appears in
+        for repository in repositories:
+            if hits[repository]:
+                with stage('refresh', repository):
+                    memory.refresh(repository)
+
+    create_directory('html')
+    failed = []
+    for index, dashboard in enumerate(dashboards):
+        name = dashboard.get('name') or 'dashboard-%d' % (index + 1)
+        path = octoviz_dir('html/%s.html' % name)
+        if not dashboard.get('repos'):
+            sys.stderr.write('Dashboard %s lists no repos, skipping...\n' % name)
+            failed.append(name)
+            continue
+
+        try:
+            with stage('dashboard', name):
+                html = memory.render(dashboard_argv(dict(dashboard, name=name), defaults))
+        except SystemExit:
+            sys.stderr.write('Invalid options for dashboard %s, skipping...\n' % name)
+            failed.append(name)
+            continue
+        except Exception as e:
+            sys.stderr.write('Error rendering dashboard %s, skipping: %s\n' % (name, e))
+            failed.append(name)
+            continue
+
+        if html is None:
+            sys.stderr.write('No data to show for dashboard %s, skipping...\n' % name)
+            failed.append(name)
+            continue
+
+        with open(path, 'w') as f:
+            f.write(html)
+        sys.stdout.write('Wrote %s\n' % path)
+
+    with stage('cache maintenance'):
+        maintain_cache([repository for repository in repositories if repository in memory.pull_data], hits, args.store,
+            args.cache_budget, args.retention)
+
+    if args.profile:
+        instrumentation.report(args.profile_trace)
+
+    if failed:
+        sys.stderr.write('%d of %d dashboards failed: %s\n' % (len(failed), len(dashboards), ', '.join(failed)))
+        sys.exit(1)
@@ -0,0 +1,257 @@
+import os, sys, json, time
+from octoviz.common import octoviz_dir, create_directory
+from octoviz.flush import flush_repository
+from octoviz.instrument import instrumentation
+
+# Size and last use of every cached repository, so keeping the cache under a budget never has to open the caches
+index_file = lambda: octoviz_dir('cache/index.json')
+etag_dir = lambda: octoviz_dir('cache/http')
+
+
+def entry_size(repository):
+    size = 0
+    for extension in ['npz', 'partial.npz', 'json']:
+        path = octoviz_dir('cache/%s.%s' % (repository, extension))
+        if os.path.exists(path):
+            size += os.path.getsize(path)
+
+    aggregates = octoviz_dir('cache/%s.aggregates' % repository)
+    if os.path.isdir(aggregates):
+        size += sum(entry.stat().st_size for entry in os.scandir(aggregates))
+
+    return size
+
+
+def is_cached(repository):
+    return any(os.path.exists(octoviz_dir('cache/%s.%s' % (repository, extension))) for extension in ['npz', 'json'])
+
+
+def scan_entries():
+    # Caches written before the index existed, taken to have last been used when they were last written
+    entries = {}
+    if not os.path.isdir(octoviz_dir('cache')):
+        return entries
+
+    for org in os.scandir(octoviz_dir('cache')):
+        if not org.is_dir() or org.path == etag_dir():
+            continue
+        for entry in os.scandir(org.path):
+            name = entry.name[:-len('.npz')] if entry.name.endswith('.npz') else entry.name[:-len('.json')]
+            if entry.name.endswith('.partial.npz') or name == entry.name or not entry.is_file():
+                continue
+            repository = '%s/%s' % (org.name, name)
+            entries[repository] = {'size': entry_size(repository), 'accessed': entry.stat().st_mtime, 'hits': 0}
+
+    return entries
+
+
+def read_index():
+    if os.path.exists(index_file()):
+        try:
+            with open(index_file(), 'r') as f:
+                return json.load(f)
+        except ValueError:
+            pass  # Half written by a run that was killed, rebuild it
+
+    return {'hits': 0, 'misses': 0, 'entries': scan_entries()}
+
+
+def write_index(index):
+    create_directory('cache')
+    temporary = '%s.%d.tmp' % (index_file(), os.getpid())
+    with open(temporary, 'w') as f:
+        json.dump(index, f)
+    os.replace(temporary, index_file())  # Runs sharing the cache never read a truncated index
+
+
+def store_rows(repositories=None):
+    # Pull requests each repository holds in the SQLite store; counting a few repositories only walks their part of
+    # the (repository, created_at) index, counting all of them scans the whole table
+    path = octoviz_dir('octoviz.db')
+    if not os.path.exists(path):
+        return {}
+
+    import sqlite3  # Read directly, the store module needs numpy and pandas
+    connection = sqlite3.connect(path, timeout=60)
+    try:
+        if repositories is None:
+            stored = [repository for repository, in connection.execute('SELECT repository FROM repositories')]
+            counts = dict(connection.execute('SELECT repository, COUNT(*) FROM pulls GROUP BY repository').fetchall())
+        else:
+            stored = [repository for repository in repositories
+                if connection.execute('SELECT 1 FROM repositories WHERE repository = ?', (repository,)).fetchone()]
+            counts = {repository: connection.execute('SELECT COUNT(*) FROM pulls WHERE repository = ?', (repository,)).fetchone()[0]
+                for repository in stored}
+    except sqlite3.OperationalError:
+        return {}  # Created, but nothing written to it yet
+    finally:
+        connection.close()
+
+    return {repository: counts.get(repository, 0) for repository in stored}
+
+
+def share_store(stored):
+    # Each repository's share of the store on disk, estimated from how many of the rows it holds
+    path = octoviz_dir('octoviz.db')
+    total = sum(os.path.getsize(path + suffix) for suffix in ['', '-wal'] if os.path.exists(path + suffix))
+    rows = sum(entry.get('rows', 0) for entry in stored.values()) or 1
+    for entry in stored.values():
+        entry['size'] = total * entry.get('rows', 0) // rows
+
+
+def record_access(index, repositories, hits, store='npz'):
+    # `hits` tells whether each repository was read from the cache rather than fetched from Github
+    now = time.time()
+    rows = store_rows(repositories) if store == 'sqlite' else None
+    entries = index.setdefault('stored', {}) if store == 'sqlite' else index['entries']
+    for repository in repositories:
+        hit = hits.get(repository, False)
+        index['hits' if hit else 'misses'] += 1
+        instrumentation.count('cache hits' if hit else 'cache misses')
+
+        if not (repository in rows if rows is not None else is_cached(repository)):
+            entries.pop(repository, None)  # Not written
+            continue
+        entry = entries.setdefault(repository, {'hits': 0})
+        if rows is not None:
+            entry['rows'] = rows[repository]
+        else:
+            entry['size'] = entry_size(repository)
+        entry.update(accessed=now, hits=entry['hits'] + hit)
+
+    if rows is not None:
+        share_store(entries)  # Rough until evict or --stats has counted every repository, both recount before using it
+
+
+def stored_entries(index):
+    # Repositories in the SQLite store, including those written before the index tracked it
+    stored = index.setdefault('stored', {})
+    rows = store_rows()
+    for repository in list(stored):
+        if repository not in rows:
+            del stored[repository]
+    for repository, count in rows.items():
+        entry = stored.setdefault(repository, {'hits': 0, 'accessed': os.path.getmtime(octoviz_dir('octoviz.db'))})
+        entry['rows'] = count
+    share_store(stored)
+
+    return stored
+
+
+def etag_entries():
+    if not os.path.isdir(etag_dir()):
+        return []
+
+    # Replaying a stored response touches its file, so the modification time is its last use
+    return [(entry.stat().st_mtime, entry.path, entry.stat().st_size) for entry in os.scandir(etag_dir()) if entry.is_file()]
+
+
+def evict(index, budget, keep=()):
+    # Drops the least recently used repositories, from the file cache or the SQLite store, and stored responses
+    # until everything fits in `budget` bytes
+    entries = index['entries']
+    stored = stored_entries(index)
+    candidates = [(entry['accessed'], 'cache', repository, entry['size']) for repository, entry in entries.items()]
+    candidates += [(entry['accessed'], 'sqlite', repository, entry['size']) for repository, entry in stored.items()]
+    total = sum(size for _, _, _, size in candidates)
+    candidates = [candidate for candidate in candidates if candidate[2] not in keep]
+    for mtime, path, size in etag_entries():
+        candidates.append((mtime, 'etag', path, size))
+        total += size
+
+    vacuum = False
+    for accessed, kind, key, size in sorted(candidates):
+        if total <= budget:
+            break
+        if kind == 'etag':
+            try:
+                os.remove(key)
+            except FileNotFoundError:
+                pass  # Evicted by another run
+        else:
+            if kind == 'cache':
+                flush_repository(key, store=False)
+                del entries[key]
+            else:
+                from octoviz.store import remove_store
+                remove_store(key)
+                del stored[key]
+                vacuum = True
+            sys.stderr.write('Evicted %s from the %s, last used %s\n' % (key, 'SQLite store' if kind == 'sqlite' else 'cache',
+                time.strftime('%Y-%m-%d', time.localtime(accessed))))
+            instrumentation.count('cache evictions')
+        total -= size
+
+    if vacuum:
+        from octoviz.store import vacuum_store
+        vacuum_store()  # Deleted rows only free their pages, the file has to be rebuilt to shrink
+
+    if total > budget:
+        sys.stderr.write('Cache is still %s over its budget, keeping the repositories used by this run\n' % format_size(total - budget))
+
+
+def compact(repositories, retention, store='npz'):
+    # Drops the pull requests created more than `retention` days ago, only rewriting caches that hold any
+    import numpy as np
+    from octoviz.cache import cache_file, read_cache, write_cache
+
+    cutoff = np.datetime64(int(time.time() - retention * 24 * 60 * 60), 's')
+    for repository in repositories:
+        if store == 'sqlite':
+            from octoviz.store import trim_store
+            dropped = trim_store(repository, cutoff.astype('int64'))
+        elif os.path.exists(cache_file(repository)):
+            with np.load(cache_file(repository)) as columns:
+                created = columns['created_at']  # Only this column is decompressed to check
+            if not len(created) or created.min() >= cutoff:
+                continue
+            dump = read_cache(repository)
+            pull_data = dump['data']
+            kept = pull_data[pull_data['created_at'] >= cutoff].reset_index(drop=True)
+            write_cache(repository, kept, dump['full'])
+            dropped = len(pull_data) - len(kept)
+        else:
+            continue  # Legacy JSON caches are converted, and compacted, the next time they are read
+
+        if dropped:
+            sys.stderr.write('Compacted %s, dropped %d pull requests created before %s\n' % (repository, dropped, cutoff.astype('datetime64[D]')))
+
+
+def maintain_cache(repositories, hits, store='npz', budget=None, retention=None):
+    # Called once a run is done with `repositories`, which are never evicted to make room
+    index = read_index()
+    if retention is not None:
+        compact(repositories, retention, store)
+    record_access(index, repositories, hits, store)
+    if budget is not None:
+        evict(index, budget, set(repositories))
+    write_index(index)
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024
+    return '%.1f TB' % size
+
+
+def report(index):
+    entries = {repository: entry for repository, entry in index['entries'].items() if is_cached(repository)}
+    stored = stored_entries(index)
+    etag_size = sum(size for _, _, size in etag_entries())
+    lookups = index['hits'] + index['misses']
+
+    rows = [(repository, entry) for repository, entry in entries.items()]
+    rows += [('%s (sqlite)' % repository, entry) for repository, entry in stored.items()]
+    lines = ['%-40s %10s %6s  %s' % ('Repository', 'Size', 'Hits', 'Last used')]
+    for repository, entry in sorted(rows, key=lambda x: -x[1]['accessed']):
+        accessed = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['accessed']))
+        lines.append('%-40s %10s %6d  %s' % (repository, format_size(entry['size']), entry['hits'], accessed))
+    lines.append('')
+    lines.append('%d repositories, %s' % (len(entries), format_size(sum(entry['size'] for entry in entries.values()))))
+    lines.append('%d repositories in the SQLite store, %s' % (len(stored), format_size(sum(entry['size'] for entry in stored.values()))))
+    lines.append('Stored API responses: %s' % format_size(etag_size))
+    lines.append('Cache hits: %d, misses: %d (%.0f%% hit rate)' % (index['hits'], index['misses'], 100 * index['hits'] / lookups if lookups else 0))
+
+    sys.stdout.write('\n'.join(lines) + '\n')
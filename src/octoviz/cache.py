@@ -0,0 +1,214 @@
+import os, sys, json, shutil, hashlib, threading
+import numpy as np
+import pandas as pd
+from octoviz.common import octoviz_dir, create_directory
+
+cache_file = lambda repository: octoviz_dir('cache/%s.npz' % repository)
+partial_cache_file = lambda repository: octoviz_dir('cache/%s.partial.npz' % repository)
+legacy_cache_file = lambda repository: octoviz_dir('cache/%s.json' % repository)
+aggregates_dir = lambda repository: octoviz_dir('cache/%s.aggregates' % repository)
+
+# The only fields of a pull request that OctoViz ever looks at
+time_columns = ['created_at', 'closed_at', 'updated_at']
+line_columns = ['additions', 'deletions']
+column_types = {'number': 'int64', **{column: 'datetime64[s]' for column in time_columns}, **{column: 'int64' for column in line_columns}}
+chunk_size = 4096
+
+
+def cache_exists(repository):
+    return os.path.exists(cache_file(repository)) or os.path.exists(legacy_cache_file(repository))
+
+
+def read_cache(repository):
+    if not os.path.exists(cache_file(repository)):
+        migrate_cache(repository)
+
+    with np.load(cache_file(repository)) as columns:
+        full = bool(columns['full'])
+        pull_data = pd.DataFrame({column: columns[column] for column in column_types})
+
+    return {'full': full, 'data': pull_data, 'watermark': high_water_mark(pull_data)}
+
+
+def save_arrays(path, compress=True, **arrays):
+    # Written next to the destination and renamed over it, so a crash never leaves a truncated file behind; the name is
+    # unique to the writer, as threads (-j) and processes (-P, overlapping runs) may write the same file at once
+    temporary = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(temporary, 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(f, **arrays)
+    os.replace(temporary, path)
+
+
+def write_cache(repository, pull_data, full):
+    create_directory('cache/%s' % repository.split('/')[0])
+
+    save_arrays(cache_file(repository), full=np.array(full), **{column: pull_data[column].values for column in column_types})
+
+    shutil.rmtree(aggregates_dir(repository), ignore_errors=True)  # Anything aggregated from the old data is stale
+
+    return {'full': full, 'data': pull_data, 'watermark': high_water_mark(pull_data)}
+
+
+def read_partial(repository, full):
+    # Pull requests collected by a cache build that didn't finish, if it was fetching the same kind of data
+    if not os.path.exists(partial_cache_file(repository)):
+        return None
+
+    with np.load(partial_cache_file(repository)) as columns:
+        if bool(columns['full']) != full:
+            return None
+        return pd.DataFrame({column: columns[column] for column in column_types})
+
+
+def write_partial(repository, chunks, full):
+    create_directory('cache/%s' % repository.split('/')[0])
+    columns = {column: np.concatenate([chunk[column].values for chunk in chunks]) for column in column_types}
+
+    save_arrays(partial_cache_file(repository), False, full=np.array(full), **columns)  # Uncompressed, it's rewritten often
+
+
+def remove_partial(repository):
+    if os.path.exists(partial_cache_file(repository)):
+        os.remove(partial_cache_file(repository))
+
+
+def checkpoint_pulls(repository, pull_data, full, partial=None, every=1000):
+    # Like pulls_to_frame, but saves everything collected so far every `every` pull requests and when the fetch
+    # fails or is interrupted, so the next run can pick up where this one stopped
+    chunks = [partial] if partial is not None else []
+    batch = []
+    try:
+        for pull in pull_data:
+            batch.append(pull)
+            if len(batch) == every:
+                chunks.append(pulls_to_frame(batch))
+                batch = []
+                write_partial(repository, chunks, full)
+    except BaseException as e:
+        if batch:
+            chunks.append(pulls_to_frame(batch))
+        if chunks:
+            write_partial(repository, chunks, full)
+            sys.stderr.write('Fetch of %s stopped, saved %d pull requests to resume from\n' % (repository, sum(len(chunk) for chunk in chunks)))
+        raise(e)
+
+    chunks.append(pulls_to_frame(batch))
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def migrate_cache(repository):
+    # Convert a JSON cache written by an older OctoViz to the columnar format
+    with open(legacy_cache_file(repository), 'r') as f:
+        dump = json.load(f)
+
+    write_cache(repository, pulls_to_frame(dump['data']), dump['full'])
+    os.remove(legacy_cache_file(repository))
+
+
+def pulls_to_frame(pull_data):
+    # Takes any iterable of pull request dicts and copies the fields we use into preallocated chunks as they arrive
+    parse_time = lambda x: x.rstrip('Z') if x else 'NaT'  # Github timestamps are always UTC
+    chunks = []
+    filled = chunk_size
+
+    for pull in pull_data:
+        if filled == chunk_size:
+            chunks.append({column: np.empty(chunk_size, dtype=dtype) for column, dtype in column_types.items()})
+            filled = 0
+        chunk = chunks[-1]
+
+        chunk['number'][filled] = pull['number']
+        for column in time_columns:
+            chunk[column][filled] = parse_time(pull[column])
+        for column in line_columns:
+            chunk[column][filled] = pull.get(column) or 0  # Short PRs have no line data
+        filled += 1
+
+    if not chunks:
+        return pd.DataFrame({column: np.empty(0, dtype=dtype) for column, dtype in column_types.items()})
+
+    chunks[-1] = {column: values[:filled] for column, values in chunks[-1].items()}
+
+    return pd.DataFrame({column: np.concatenate([chunk[column] for chunk in chunks]) for column in column_types})
+
+
+def high_water_mark(pull_data):
+    if pull_data.empty:
+        return None
+
+    updated = pull_data['updated_at'].max()
+
+    return {
+        'closed_at': pull_data['closed_at'].max().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'updated_at': updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'numbers': pull_data['number'][pull_data['updated_at'] == updated].tolist(),
+    }
+
+
+def merge_pull_data(cached, fetched):
+    merged = pd.concat([cached, fetched], ignore_index=True)
+    merged = merged.drop_duplicates('number', keep='last')  # Newer data wins
+
+    return merged.sort_values('created_at', ascending=False).reset_index(drop=True)
+
+
+def aggregate_key(repository, params, version=None):
+    # The raw cache's size and modification time stand in for its version, so a rewrite invalidates every key
+    if version is not None:
+        key = json.dumps(['store', version, params], sort_keys=True)  # Data kept in the SQLite store has a real version
+    else:
+        stat = os.stat(cache_file(repository) if os.path.exists(cache_file(repository)) else legacy_cache_file(repository))
+        key = json.dumps([stat.st_mtime_ns, stat.st_size, params], sort_keys=True)
+
+    # Prefixed with the parameters minus the period they were built in, which names the keys a newer one replaces
+    family = json.dumps({name: value for name, value in params.items() if name != 'now'}, sort_keys=True)
+
+    return '%s.%s' % (hashlib.sha1(family.encode()).hexdigest()[:16], hashlib.sha1(key.encode()).hexdigest())
+
+
+def read_aggregates(repository, key):
+    path = '%s/%s.npz' % (aggregates_dir(repository), key)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as stored:
+        meta = json.loads(str(stored['meta']))
+        tables = {name: table_from_arrays(stored, name, meta['datetime']) for name in meta['tables']}
+
+    return {'group': meta['group'], 'titles': meta['titles'], 'data': tables['data'], 'compare_data': tables.get('compare_data')}
+
+
+def write_aggregates(repository, key, aggregates):
+    create_directory('cache/%s.aggregates' % repository)
+    tables = {name: aggregates[name] for name in ['data', 'compare_data'] if aggregates[name] is not None}
+    meta = {
+        'group': aggregates['group'],
+        'titles': aggregates['titles'],
+        'tables': list(tables),
+        'datetime': isinstance(tables['data'].index, pd.DatetimeIndex),
+    }
+
+    arrays = {'meta': np.array(json.dumps(meta))}
+    for name, table in tables.items():
+        index = table.index.tz_convert(None) if meta['datetime'] else table.index
+        arrays['%s/index' % name] = index.values
+        arrays['%s/columns' % name] = np.array(table.columns, dtype=str)
+        arrays['%s/values' % name] = table.values
+
+    save_arrays('%s/%s.npz' % (aggregates_dir(repository), key), False, **arrays)
+
+    # Aggregates of the same parameters for an earlier period or version of the data are never read again
+    family = key.split('.')[0]
+    for entry in os.scandir(aggregates_dir(repository)):
+        if entry.name.startswith(family + '.') and entry.name.endswith('.npz') and entry.name != '%s.npz' % key:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # Removed by another run
+
+
+def table_from_arrays(stored, name, is_datetime):
+    index = stored['%s/index' % name]
+    index = pd.DatetimeIndex(index).tz_localize('UTC') if is_datetime else pd.Index(index)
+    return pd.DataFrame(stored['%s/values' % name], index=index, columns=stored['%s/columns' % name].tolist())
@@ -1,11 +1,23 @@
 from pathlib import Path
-import os, sys, json
-import arrow, github3
+from collections import deque
+import os, sys, json, threading, itertools
+from octoviz.instrument import instrumentation, stage
+from octoviz.graphql import graphql_url, iter_pull_requests
+
+try:
+    from orjson import loads as parse_json  # Much faster at decoding the large pages of the REST API
+except ImportError:
+    parse_json = json.loads
 
 # Global constants
 home_dir = str(Path.home())
 octoviz_dir = lambda x="": '%s/.octoviz%s' % (home_dir, "/%s" % x if x else "")
-clients = []
+profiles = []  # Every available profile, in the order repositories are searched for
+clients = {}  # Logged in clients by profile name, only created once a profile is actually needed
+resolutions = None  # Which profile each repository was last found under
+adapter = None  # Connection pool and request scheduler shared by the sessions of every client
+clients_lock = threading.Lock()
+resolutions_file = lambda: octoviz_dir('cache/repositories.json')
 
 def create_directory(dir):
     exists = []
@@ -13,11 +25,14 @@ def create_directory(dir):
 
     for di in create:
         path = '/'.join(exists + [di])
-        if not os.path.exists(octoviz_dir(path)):
-            os.mkdir(octoviz_dir(path))
+        os.makedirs(octoviz_dir(path), exist_ok=True)  # Repositories of the same org may be fetched concurrently
         exists.append(di)
 
 def make_github_client(profile):
+    import github3
+    from requests import Request
+    from octoviz.ratelimit import RateLimit
+
     token = profile['token']
     url = profile['url']
     try:
@@ -32,45 +47,175 @@ def make_github_client(profile):
         sys.stderr.write("\nError performing login to Github!\n")
         sys.stderr.write("Check the token or url for login of profile %s\n\n" % profile['name'])
         raise(e)  ## Re-raise the exception to handle it somewhere else in the stack
+
+    client.profile_name = profile['name']
+    client.url = url or None  # Profiles on the same server can share the work of a fetch
+    client.backend = profile.get('backend') or 'rest'  # Profiles created before backends existed use REST
+    client.graphql_url = graphql_url(profile)
+    client.session.hooks['response'].append(instrumentation.record_response)
+
+    if adapter is not None:
+        client.session.mount('https://', adapter)
+        client.session.mount('http://', adapter)
+        client.rate_limiter = adapter.limit_for(client.session.prepare_request(Request('GET', client.session.base_url)))
+    else:
+        client.rate_limiter = RateLimit()
     
     return client
 
-def get_raw_pull_data(organization, repository, rate_limit, full):
+def ordered_map(func, iterable, workers):
+    # Like executor.map, but only keeps a bounded number of calls in flight instead of consuming the whole iterable
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+class PullRecord:
+    # The fields of a pull request OctoViz keeps, read straight from the API's JSON instead of building github3
+    # objects for the users, repositories and refs attached to it only to throw them away
+    __slots__ = ('number', 'created_at', 'closed_at', 'updated_at', 'additions', 'deletions')
+
+    def __init__(self, pull):
+        self.number = pull['number']
+        self.created_at = pull['created_at']
+        self.closed_at = pull['closed_at']
+        self.updated_at = pull['updated_at']
+        self.additions = pull.get('additions')  # Only the single pull request endpoint has line data
+        self.deletions = pull.get('deletions')
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+def get_json(session, url, params=None):
+    response = session.get(url, params=params)
+    response.raise_for_status()
+    return response, parse_json(response.content)
+
+def iter_pull_pages(repo, params, slices=1):
+    # Walks the pull request list following the next links, or requests `slices` pages at a time when slices > 1
+    url = repo._build_url('pulls', base_url=repo._api)
+    params = dict(params, per_page=100)
+
+    def linked_pages():
+        next_url, next_params = url, params
+        while next_url:
+            response, page = get_json(repo.session, next_url, next_params)
+            yield page
+            next_url, next_params = response.links.get('next', {}).get('url'), None
+
+    def fetch_page(page):
+        return get_json(repo.session, url, dict(params, page=page))[1]
+
+    def number_at(position):
+        page = get_json(repo.session, url, dict(params, per_page=1, page=position))[1]
+        return page[0]['number'] if page else None
+
+    def sliced_pages():
+        # A pull request closing while a batch is in flight shifts the list, and can push another one from a page fetched
+        # late onto a page fetched early, where neither sees it. The pull request at the end of the batch is looked up before
+        # and after it, and if the list moved the batch is fetched again one page after another. Batches never overlap in
+        # time, so between them a shift can only repeat a pull request, never hide one
+        for first in itertools.count(1, slices):
+            numbers = range(first, first + slices)
+            before = number_at(numbers[-1] * 100)
+            pages = list(ordered_map(fetch_page, numbers, slices))
+            last = pages[-1][-1]['number'] if len(pages[-1]) == 100 else None
+            if last != before or number_at(numbers[-1] * 100) != before:
+                instrumentation.count('refetched pages', slices)
+                pages = [fetch_page(page) for page in numbers]
+            yield from pages
+
+    seen = set()
+    for page in linked_pages() if slices == 1 else sliced_pages():
+        if not page:
+            break  # Past the last page
+        for pull in page:
+            if pull['number'] in seen:
+                continue  # Shifted onto the next page by a pull request closed while fetching
+            seen.add(pull['number'])
+            yield PullRecord(pull)
+
+def get_raw_pull_data(organization, repository, rate_limit, full, since=None, workers=1, skip=None, shard=False, slices=1):
+    import arrow
+
     if rate_limit:
         frame = rate_limit[0][:-1]
         shift = {rate_limit[0]: rate_limit[1]}
         limited = arrow.now().shift(**shift).floor(frame)
     else:
         limited = None
-    repo = None
-    for client in clients:
-        try:
-            repo = client.repository(organization, repository)
-            break  # Found the repo, stop searching
-        except Exception as e:
-            continue  # Try the next client
+    with stage('repository lookup', '%s/%s' % (organization, repository)):
+        client, repo = find_repository(organization, repository)
     
     if repo is None:
         return None  # Can't find it under any of the profiles, return None
-    pull_requests = repo.pull_requests(state='closed')
 
-    result = []
-    for pull_request in pull_requests:
-        if limited is not None and arrow.get(pull_request.created_at).floor(frame) <= limited:
-            break
+    graphql = client.backend == 'graphql'
+
+    if since is not None:
+        high_water = arrow.get(since['updated_at'])
+
+    if graphql:
+        # Line changes come with every page, so --full never needs per-PR requests
+        order = 'CREATED_AT' if since is None else 'UPDATED_AT'
+        pull_requests = iter_pull_requests(client, organization, repository, order)
+    elif since is None:
+        pull_requests = iter_pull_pages(repo, {'state': 'closed'}, slices)
+    else:
+        # Most recently updated first, so everything past the high-water mark has already been cached
+        pull_requests = iter_pull_pages(repo, {'state': 'closed', 'sort': 'updated', 'direction': 'desc'}, slices)
+
+    def within_limits():
+        for pull_request in pull_requests:
+            if since is not None:
+                updated = arrow.get(pull_request['updated_at'])
+                if updated < high_water:
+                    break
+                if updated == high_water and pull_request['number'] in since['numbers']:
+                    continue  # Seen on the last fetch and unchanged since
+                if limited is not None and arrow.get(pull_request['created_at']).floor(frame) <= limited:
+                    continue  # Not sorted by creation, so keep looking
+            elif limited is not None and arrow.get(pull_request['created_at']).floor(frame) <= limited:
+                break
+            if skip is not None and pull_request['number'] in skip:
+                continue  # Already collected by an interrupted fetch
+
+            yield pull_request
+
+    if full and not graphql and shard:
+        pool = token_pool(organization, repository, client, repo)
+        sys.stderr.write('Sharding detail fetches of %s/%s across %d tokens\n' % (organization, repository, len(pool.shards)))
+    else:
+        pool = None
 
+    def fetch_full(pull_request):
         try:
-            if full:
-                pull_dict = repo.pull_request(pull_request.number).as_dict()  # Get the full data
-            else:
-                pull_dict = pull_request.as_dict()
+            detail_repo = repo if pool is None else pool.acquire()
+            url = detail_repo._build_url('pulls', str(pull_request['number']), base_url=detail_repo._api)
+            return PullRecord(get_json(detail_repo.session, url)[1])  # Get the full data
         except Exception as e:
-            continue
-        
-        
-        result.append(pull_dict)
+            # Only reached once the scheduler has given up retrying, so the PR really is missing from the results
+            number = pull_request['number']
+            sys.stderr.write('Could not fetch pull request #%d of %s/%s, skipping: %s\n' % (number, organization, repository, e))
+            instrumentation.count('dropped pull requests')
+            return None
+
+    if full and not graphql:
+        pulls = ordered_map(fetch_full, within_limits(), workers)
+    else:
+        pulls = within_limits()
 
-    return result
+    # Lazy, so callers can consume pull requests as they arrive instead of holding every one of them
+    return (pull_dict for pull_dict in pulls if pull_dict is not None)
 
 def load_profile(name):
     if name[-8:] == '.profile':
@@ -103,11 +248,89 @@ def get_all_profiles():
 
     return profiles
 
-def clients_from_profiles():
-    profiles = map(lambda x: load_profile(x), get_all_profiles())
+def prepare_clients(pool_size=10, etags=True):
+    from octoviz.ratelimit import Scheduler
+
+    global adapter
+    # Keep-alive connections reused across profiles, with a rate limit budget and ETags kept per token
+    etag_dir = octoviz_dir('cache/http') if etags else None  # Runs that write no cache leave nothing on disk
+    adapter = Scheduler(etag_dir, pool_connections=pool_size, pool_maxsize=pool_size)
+    profiles[:] = [load_profile(name) for name in get_all_profiles()]
+    clients.clear()
+
+
+def get_client(profile):
+    with clients_lock:
+        if profile['name'] not in clients:
+            try:
+                clients[profile['name']] = make_github_client(profile)
+            except Exception:
+                sys.stderr.write('Error connecting to client from profile %s, skipping...\n' % profile['name'])
+                clients[profile['name']] = None  # Don't retry a failed login for every repository
+
+        return clients[profile['name']]
+
+
+def resolved_profile(name):
+    global resolutions
+    with clients_lock:
+        if resolutions is None:
+            resolutions = {}
+            if os.path.exists(resolutions_file()):
+                try:
+                    with open(resolutions_file(), 'r') as f:
+                        resolutions = json.load(f)
+                except ValueError:
+                    pass  # Left corrupt by a run that was killed, the profiles are simply searched again
+
+        return resolutions.get(name)
+
+
+def remember_profile(name, profile_name):
+    with clients_lock:
+        resolutions[name] = profile_name
+        create_directory('cache')
+        temporary = '%s.%d.tmp' % (resolutions_file(), os.getpid())
+        with open(temporary, 'w') as f:
+            json.dump(resolutions, f)
+        os.replace(temporary, resolutions_file())  # Other processes only ever read a complete file
+
+
+def token_pool(organization, repository, client, repo):
+    # Every profile on the same server as `client` that can also see the repository, each spending its own budget
+    from octoviz.ratelimit import TokenPool
+
+    shards = [(client.rate_limiter, repo)]
     for profile in profiles:
+        if (profile['url'] or None) != client.url or profile['name'] == client.profile_name:
+            continue
+        other = get_client(profile)
+        if other is None or any(other.rate_limiter is limit for limit, _ in shards):
+            continue  # Can't log in, or another profile for the same token
+        try:
+            shards.append((other.rate_limiter, other.repository(organization, repository)))
+        except Exception as e:
+            continue  # This token can't see the repository
+
+    return TokenPool(shards)
+
+
+def find_repository(organization, repository):
+    name = '%s/%s' % (organization, repository)
+    known = resolved_profile(name)
+
+    # Try the profile the repository was last found under first, so other profiles are never logged in to
+    for profile in sorted(profiles, key=lambda x: x['name'] != known):
+        client = get_client(profile)
+        if client is None:
+            continue
         try:
-            clients.append(make_github_client(profile))  # Add to the global space client list for shared access
-        except Exception:
-            sys.stderr.write('Error connecting to client from profile %s, skipping...\n' % profile['name'])
-                
\ No newline at end of file
+            repo = client.repository(organization, repository)
+        except Exception as e:
+            continue  # Try the next client
+
+        if profile['name'] != known:
+            remember_profile(name, profile['name'])
+        return client, repo
+
+    return None, None
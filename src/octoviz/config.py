@@ -1,7 +1,18 @@
 import argparse
-from octoviz.flush import flush
-from octoviz.run import run
-from octoviz.profile import profile_list, profile_delete, profile_create_update
+from functools import partial
+from importlib import import_module
+
+def command(module, name, args, **kwargs):
+    # Subcommands only import their module once they run, so `profile` and `flush` never load bokeh, pandas or github3
+    return getattr(import_module(module), name)(args, **kwargs)
+
+def size(value):
+    # A number of bytes, optionally with a K, M, G or T suffix (2G, 500MB...)
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    value = value.strip().upper().rstrip('B')
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
 
 def configuration():
     main_parser = argparse.ArgumentParser(description='A tool to visualize Github data')
@@ -9,6 +20,10 @@ def configuration():
 
     flush_parser = sub_parsers.add_parser('flush', help='Flush the cached or created files', description='Sub-tool to flush cached and rendered files')
     parser = sub_parsers.add_parser('run', help='Run the OctoViz', description='Creates graphs of Pull Request lifecycle data')
+    serve_parser = sub_parsers.add_parser('serve', help='Serve dashboards over HTTP from data kept in memory',
+        description='Runs a local HTTP server that renders OctoViz dashboards on request, refreshing the data in the background')
+    batch_parser = sub_parsers.add_parser('batch', help='Render every dashboard listed in a manifest file',
+        description='Renders every dashboard listed in a YAML (or JSON) manifest in one go, loading each repository only once')
     profile_parser = sub_parsers.add_parser('profile', help='Create, edit, or save OctoViz Github profiles', 
         description='Create, edit, or save OctoViz Github profiles')
 
@@ -27,16 +42,25 @@ def configuration():
     profile_update_parser.add_argument('-u', '--url', nargs='?', default=False, const=None,
         help='The new URL to connect with. Specify no argument if switching to public Github server')
 
+    profile_update_parser.add_argument('-b', '--backend', choices=['rest', 'graphql'], help='The new API to fetch pull request data with')
+
     profile_delete_parser.add_argument('profile_names', metavar='NAME', nargs='+', help='The name of the profile(s) to be deleted')
 
     profile_create_parser.add_argument('-u', '--url', action='store', help='The URL for the server OctoViz should use. Include only if using an Enterprise server')
     profile_create_parser.add_argument('-n', '--name', action='store', help='The name of the profile to be created (default: \'default\')', default='default')
     profile_create_parser.add_argument('-t', '--token', action='store', help='The token OctoViz should use to authenticate to the server', required=True)
+    profile_create_parser.add_argument('-b', '--backend', choices=['rest', 'graphql'], default='rest',
+        help='The Github API to fetch pull request data with. GraphQL fetches line changes with every page of 100 PRs, so --full costs no extra requests (default: rest)')
 
     profile_parser.add_argument('-l', '--list', action='store_true', help='List all available profiles')
 
     flush_parser.add_argument('-f', '--flush-all', action='store', nargs='?', default=False, const='all',
         choices=['cache', 'html', 'all'], help='Flushes all cached data and html files by default, or one of them if specified')
+    flush_parser.add_argument('--budget', metavar='SIZE', type=size,
+        help='Evict the least recently used repositories until the cache takes at most SIZE (e.g. 500M, 2G)')
+    flush_parser.add_argument('--retention', metavar='DAYS', type=int,
+        help='Compact every cached repository by dropping the pull requests created more than DAYS days ago')
+    flush_parser.add_argument('--stats', action='store_true', help='Show the size, hits and last use of every cached repository')
     flush_parser.add_argument('repos', metavar='repository', nargs='*', default=[], help="Repositories to flush from the cache")
 
     parser.add_argument('-m', '--month', dest='frame', action='store_const', const='month', default='week', help='aggregate data by month (default: by week)')
@@ -47,6 +71,8 @@ def configuration():
 
     cache_group.add_argument('-b', '--build-cache', dest='force_build_cache', action='store_true', 
         help='Force build the cache, overriding any currently cached data.')
+    cache_group.add_argument('-r', '--refresh', action='store_true',
+        help='Fetch only the PRs closed or updated since the cache was last built and merge them into it')
     cache_group.add_argument('--no-cache', dest='fetch_no_cache', action='store_true', help='Force fetch the data but do not write it to a local cache')
 
     limit_group.add_argument('--no-limit', action='store_true', help='Retrieve all PR data from the repository. (default: 12 months)')
@@ -57,11 +83,41 @@ def configuration():
     
     parser.add_argument('--full', action='store_true', 
         help='Grabs the full Pull Request data for more thorough data processing (grouping by additions/deletions/total). WARNING: this will take a long time')
+    parser.add_argument('-w', '--workers', metavar='N', type=int, default=8,
+        help='Number of pull requests to fetch in parallel when using --full. Default is 8')
+    parser.add_argument('--slices', metavar='N', type=int, default=1,
+        help='Fetch N pages of the pull request list of a repository at a time instead of one after another (REST profiles only). Default is 1')
+    parser.add_argument('--shard-tokens', action='store_true',
+        help='Spread --full fetches across the tokens of every profile for the same server, each with its own rate limit')
+    parser.add_argument('--store', choices=['npz', 'sqlite'], default='npz',
+        help='''Keep fetched pull requests in a file per repository (npz), or in one SQLite database under ~/.octoviz (sqlite)
+        that only reads the pull requests inside the requested time window (default: npz)''')
+    parser.add_argument('--checkpoint', metavar='N', type=int, default=1000,
+        help='Save the progress of a cache build every N pull requests, so an interrupted build resumes from there (default: 1000)')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+        help='Number of repositories to fetch and aggregate in parallel. Default is 1')
+    parser.add_argument('-P', '--processes', metavar='N', type=int, default=1,
+        help='Number of repositories to load and aggregate in separate processes, to use more than one core. Default is 1')
+    parser.add_argument('--pool-size', metavar='N', type=int,
+        help='Number of keep-alive connections to keep open to each Github server. Default is enough for --workers times --jobs')
+    parser.add_argument('--profile', action='store_true',
+        help='Print a summary of the time spent in each stage, and of the Github API requests made, after running')
+    parser.add_argument('--profile-trace', metavar='FILE', help='Also write the --profile data to FILE as JSON')
+    parser.add_argument('--cprofile', metavar='FILE', help='Capture a cProfile of the run and save its stats to FILE')
     parser.add_argument('--no-render', action='store_true', help='Prevent OctoViz from generating HTML file')
+    parser.add_argument('--cache-budget', metavar='SIZE', type=size,
+        help='After running, evict the least recently used repositories until the cache takes at most SIZE (e.g. 500M, 2G)')
+    parser.add_argument('--retention', metavar='DAYS', type=int,
+        help='After running, drop the pull requests created more than DAYS days ago from the caches of the repositories used')
     parser.add_argument('--cleanup', action='store_true', help='Flushes all cached data after execution. Does not delete html files.')
     parser.add_argument('-x', '--link-x-axis', dest='link_x', action='store_true', help='Link the x-axis of all generated graphs')
     parser.add_argument('-y', '--link-y-axis', dest='link_y', action='store_true', help='Link the y-axis of all line graphs')
     parser.add_argument('-n', '--name', action='store', help='Name of the output file')
+    parser.add_argument('--webgl', action='store_true', help='Draw graphs with WebGL, which is faster in the browser for large dashboards')
+    parser.add_argument('--resources', choices=['cdn', 'inline', 'relative', 'absolute'], default='cdn',
+        help='Where the HTML file loads BokehJS from: the Bokeh CDN, inlined into the file, or the local Bokeh installation (default: cdn)')
+    parser.add_argument('--max-points', metavar='N', type=int,
+        help='Plot at most N evenly spaced points per graph, so very long histories stay quick to draw')
     parser.add_argument('--complete', action='store_true', help="Display only complete data (does not display current week/month's data)")
     parser.add_argument('-p', '--percentiles', type=str, default='25,50,90', help="A comma delimited list of percentiles to render data for")
 
@@ -75,18 +131,48 @@ def configuration():
     compr_group.add_argument('--compare-last', dest='compare_last', choices=['week', 'month', 'quarter', 'year'],
         help='''Render two sets of graphs for each repository comparing the previous selected time period to the one before it.
         Can only be used in conjuction with --analyze-by.''')
+    parser.add_argument('--rollup', metavar='NAME', nargs='?', const='all repositories',
+        help='''Combine every repository into a single graph named NAME, merging a sketch of each repository's lifetimes
+        (kept with its cache) instead of re-reading every pull request. Percentiles are accurate to within 1%%''')
     parser.add_argument('--round-to', type=int, default=20, 
         help='The number of lines to round to. Can only be used in conjunction with --analyze-by. Default is 20')
     parser.add_argument('repos', metavar='repository', nargs='+', default=[], help='Repository to pull data from')
 
+    serve_parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    serve_parser.add_argument('--port', type=int, default=8000, help='Port to listen on (default: 8000)')
+    serve_parser.add_argument('--refresh-every', metavar='MINUTES', type=int, default=60,
+        help='How often to fetch the changes to every loaded repository from Github (default: 60 minutes)')
+    serve_parser.add_argument('--full', action='store_true', help='Build caches that do not exist yet with the full Pull Request data')
+    serve_parser.add_argument('--store', choices=['npz', 'sqlite'], default='npz', help='Where fetched pull requests are kept, as for run (default: npz)')
+    serve_parser.add_argument('-w', '--workers', metavar='N', type=int, default=8,
+        help='Number of pull requests to fetch in parallel when using --full. Default is 8')
+    serve_parser.add_argument('--pool-size', metavar='N', type=int, help='Number of keep-alive connections to keep open to each Github server')
+    serve_parser.add_argument('repos', metavar='repository', nargs='*', default=[], help='Repositories to load when the server starts')
+
+    batch_parser.add_argument('manifest', metavar='MANIFEST', help='The manifest listing the dashboards to render')
+    batch_parser.add_argument('-r', '--refresh', action='store_true', help='Fetch what changed on Github for every cached repository first')
+    batch_parser.add_argument('--full', action='store_true', help='Build caches that do not exist yet with the full Pull Request data')
+    batch_parser.add_argument('--store', choices=['npz', 'sqlite'], default='npz', help='Where fetched pull requests are kept, as for run (default: npz)')
+    batch_parser.add_argument('-w', '--workers', metavar='N', type=int, default=8,
+        help='Number of pull requests to fetch in parallel when using --full. Default is 8')
+    batch_parser.add_argument('--pool-size', metavar='N', type=int, help='Number of keep-alive connections to keep open to each Github server')
+    batch_parser.add_argument('--cache-budget', metavar='SIZE', type=size,
+        help='After rendering, evict the least recently used repositories until the cache takes at most SIZE (e.g. 500M, 2G)')
+    batch_parser.add_argument('--retention', metavar='DAYS', type=int,
+        help='After rendering, drop the pull requests created more than DAYS days ago from the caches of the repositories used')
+    batch_parser.add_argument('--profile', action='store_true', help='Print a summary of the time spent in each stage after running')
+    batch_parser.add_argument('--profile-trace', metavar='FILE', help='Also write the --profile data to FILE as JSON')
+
     parser.epilog = 'All files are stored under ~/.octoviz directory. If no output file name has been specified, OctoViz will override previous render'
 
     # Attach the parsers to the right functions
-    parser.set_defaults(func=run)
-    flush_parser.set_defaults(func=flush)
-    profile_parser.set_defaults(func=profile_list)
-    profile_delete_parser.set_defaults(func=profile_delete)
-    profile_update_parser.set_defaults(func=lambda args: profile_create_update(args, False))
-    profile_create_parser.set_defaults(func=lambda args: profile_create_update(args, True))
+    parser.set_defaults(func=partial(command, 'octoviz.run', 'run'))
+    flush_parser.set_defaults(func=partial(command, 'octoviz.flush', 'flush'))
+    serve_parser.set_defaults(func=partial(command, 'octoviz.serve', 'serve'))
+    batch_parser.set_defaults(func=partial(command, 'octoviz.batch', 'batch'))
+    profile_parser.set_defaults(func=partial(command, 'octoviz.profile', 'profile_list'))
+    profile_delete_parser.set_defaults(func=partial(command, 'octoviz.profile', 'profile_delete'))
+    profile_update_parser.set_defaults(func=partial(command, 'octoviz.profile', 'profile_create_update', create=False))
+    profile_create_parser.set_defaults(func=partial(command, 'octoviz.profile', 'profile_create_update', create=True))
 
     return main_parser
\ No newline at end of file
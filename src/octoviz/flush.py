@@ -1,13 +1,42 @@
 import shutil, os
 from octoviz.common import octoviz_dir
 
+def flush_repository(repo, store=True):
+    for extension in ['npz', 'partial.npz', 'json']:
+        if os.path.exists(octoviz_dir('cache/%s.%s' % (repo, extension))):
+            os.remove(octoviz_dir('cache/%s.%s' % (repo, extension)))
+    shutil.rmtree(octoviz_dir('cache/%s.aggregates' % repo), ignore_errors=True)
+    if store and os.path.exists(octoviz_dir('octoviz.db')):
+        from octoviz.store import remove_store  # Only loaded when there is a store to flush
+        remove_store(repo)
+
 def flush(args):
     if args.flush_all:
         if args.flush_all in {'cache', 'all'}:
             shutil.rmtree(octoviz_dir('cache'), ignore_errors=True)
+            for suffix in ['', '-wal', '-shm']:
+                if os.path.exists(octoviz_dir('octoviz.db' + suffix)):
+                    os.remove(octoviz_dir('octoviz.db' + suffix))
         if args.flush_all in {'html', 'all'}:
             shutil.rmtree(octoviz_dir('html'), ignore_errors=True)
     else:
         for repo in args.repos:
-            if os.path.exists(octoviz_dir('cache/%s.json' % repo)):
-                os.remove(octoviz_dir('cache/%s.json' % repo))
\ No newline at end of file
+            flush_repository(repo)
+
+    if args.retention is not None or args.budget is not None or args.stats:
+        from octoviz import budget  # Reads only the cache index, unless compacting
+
+        index = budget.read_index()
+        if args.retention is not None:
+            budget.compact(list(index['entries']), args.retention)
+            if os.path.exists(octoviz_dir('octoviz.db')):
+                from octoviz.store import stored_repositories
+                budget.compact(stored_repositories(), args.retention, 'sqlite')
+            for repository in index['entries']:
+                if budget.is_cached(repository):
+                    index['entries'][repository]['size'] = budget.entry_size(repository)
+        if args.budget is not None:
+            budget.evict(index, args.budget)
+        budget.write_index(index)
+        if args.stats:
+            budget.report(index)
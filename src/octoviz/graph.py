@@ -1,8 +1,16 @@
 import re, itertools
+import numpy as np
 from bokeh.plotting import figure, ColumnDataSource
 from bokeh.palettes import Category10 as palette
 
-def data_to_graph_params(data, width, name_map, is_datetime, round_to, skip_last=False):
+def downsample(data, max_points):
+    # Evenly spaced rows, always keeping the first and the last bucket
+    if max_points is None or len(data) <= max_points:
+        return data
+    return data.iloc[np.unique(np.linspace(0, len(data) - 1, max_points).round().astype(int))]
+
+
+def data_to_graph_params(data, width, name_map, is_datetime, round_to, skip_last=False, max_points=None):
     def colors():
         yield from itertools.cycle(palette[10])
         
@@ -10,13 +18,16 @@ def data_to_graph_params(data, width, name_map, is_datetime, round_to, skip_last
     line_result = {}
     bar_result = {}
     end_index = -1 if skip_last else None
-    for param in data:
+    data = downsample(data.sort_index().iloc[:end_index], max_points)
+    buckets = data.index
+    x = buckets.values  # Plain arrays go straight into the ColumnDataSource
+    if is_datetime:
+        labels = buckets.strftime('%b %d %y').tolist()
+    else:
+        labels = ['%d-%d' % (key, key+round_to-1) for key in x]
+    for param in data.columns:
         match = re.match('(1?[0-9]?[0-9])th', param)
-        x = []
-        y = []
-        for key in sorted(data[param].keys())[:end_index]:
-            x.append(key)
-            y.append(data[param][key])
+        y = data[param].values
         if match:
             line_result[param] = {
                 'legend': "{}%-tile time".format(match[1]),
@@ -25,10 +36,7 @@ def data_to_graph_params(data, width, name_map, is_datetime, round_to, skip_last
                 'y': y,
                 'time': y
             }
-            if is_datetime:
-                line_result[param]['date'] = list(map(lambda x: x.strftime('%b %d %y'), x))
-            else:
-                line_result[param]['lines'] = list(map(lambda x: '%d-%d' % (x, x+round_to-1), x))
+            line_result[param]['date' if is_datetime else 'lines'] = labels
         else:
             bar_result[param] = {
                 'width': width,
@@ -40,7 +48,22 @@ def data_to_graph_params(data, width, name_map, is_datetime, round_to, skip_last
     return line_result, bar_result
 
 
-def graph(line_data, bar_data, repository_name, frame, grouped, x_range=None, y_range=None, bar_y_range=None, is_datetime=True, custom_title = ""):
+def chart_source(line_data, bar_data, is_datetime):
+    # One source holding every percentile and the bar heights, so the x values and labels are only stored once
+    label = 'date' if is_datetime else 'lines'
+    data = {}
+    for key in line_data.keys():
+        data['x'] = line_data[key]['x']
+        data[label] = line_data[key][label]
+        data[key] = line_data[key]['y']
+    for key in bar_data.keys():
+        data['bar_x'] = bar_data[key]['x']
+        data[key] = bar_data[key]['top']
+
+    return ColumnDataSource(data=data)
+
+
+def graph(line_data, bar_data, repository_name, frame, grouped, x_range=None, y_range=None, bar_y_range=None, is_datetime=True, custom_title = "", webgl=False):
     axis_type = 'datetime' if is_datetime else 'linear'
     time = frame if is_datetime else 'lines changed -'
     if custom_title:
@@ -50,18 +73,20 @@ def graph(line_data, bar_data, repository_name, frame, grouped, x_range=None, y_
     if is_datetime:
         tooltips = [
             ('Date', '@date'),
-            ('Days to close', '@time')
+            ('Days to close', '@$name')  # The column of whichever percentile is hovered
         ]
     else:
         tooltips = [
             ('Lines', '@lines'),
-            ('Days to close', '@time')
+            ('Days to close', '@$name')
         ]
+    backend = 'webgl' if webgl else 'canvas'
     line_chart = figure(
         title=title,
         x_axis_label="Date" if is_datetime else "Number of lines", 
         y_axis_label='Time to close PR (days)',
         x_axis_type=axis_type,
+        output_backend=backend,
         tooltips=tooltips)
 
     if x_range is not None:
@@ -69,7 +94,7 @@ def graph(line_data, bar_data, repository_name, frame, grouped, x_range=None, y_
     if y_range is not None:
         line_chart.y_range = y_range
 
-    bar_tooltip = [('Pull Requests', '@top')]
+    bar_tooltip = [('Pull Requests', '@$name')]
 
     if not is_datetime:
         bar_tooltip.insert(0, ('Lines', '@lines'))
@@ -79,34 +104,19 @@ def graph(line_data, bar_data, repository_name, frame, grouped, x_range=None, y_
         x_axis_label='Date' if is_datetime else 'Number of Lines',
         x_range=line_chart.x_range,
         x_axis_type=axis_type,
+        output_backend=backend,
         tooltips=bar_tooltip)
     
     if bar_y_range is not None:
         bar_chart.y_range = bar_y_range
-    lines = []
-    for key in line_data.keys():
-        
-        data_dict = dict(
-            x=line_data[key]['x'],
-            y=line_data[key]['y'],
-            time=line_data[key]['time']
-        )
-        if is_datetime:
-            data_dict['date'] = line_data[key]['date']
-        else:
-            data_dict['lines'] = line_data[key]['lines']
-            lines = line_data[key]['lines']
 
-        source = ColumnDataSource(data=data_dict)
-        line_chart.line('x', 'y', line_width=2, source=source, legend=line_data[key]['legend'], line_color=line_data[key]['color'])
-        line_chart.circle('x', 'y', size=5, source=source, legend=line_data[key]['legend'], color=line_data[key]['color'])
+    source = chart_source(line_data, bar_data, is_datetime)
+    for key in line_data.keys():
+        line_chart.line('x', key, name=key, line_width=2, source=source, legend=line_data[key]['legend'], line_color=line_data[key]['color'])
+        line_chart.circle('x', key, name=key, size=5, source=source, legend=line_data[key]['legend'], color=line_data[key]['color'])
     
     for key in bar_data.keys():
-        data_dict = dict(x=bar_data[key]['x'], top=bar_data[key]['top'])
-        if not is_datetime:
-            data_dict['lines'] = lines
-        source = ColumnDataSource(data=data_dict)
-        bar_chart.vbar('x', bar_data[key]['width'], 'top', source=source, fill_color=bar_data[key]['fill_color'])
+        bar_chart.vbar('bar_x', bar_data[key]['width'], key, name=key, source=source, fill_color=bar_data[key]['fill_color'])
     
     line_chart.legend.click_policy = 'hide'
 
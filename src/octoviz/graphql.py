@@ -0,0 +1,51 @@
+import sys
+
+page_size = 100  # The most the GraphQL API allows per connection
+
+pull_requests_query = '''
+query($owner: String!, $name: String!, $cursor: String, $order: IssueOrderField!) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(states: [CLOSED, MERGED], first: %d, after: $cursor, orderBy: {field: $order, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes { number createdAt closedAt mergedAt updatedAt additions deletions }
+    }
+  }
+}
+''' % page_size
+
+
+def graphql_url(profile):
+    if profile['url']:
+        return '%s/api/graphql' % profile['url'].rstrip('/')
+    return 'https://api.github.com/graphql'
+
+
+def iter_pull_requests(client, organization, repository, order='CREATED_AT'):
+    # Yields closed pull requests in the same shape the REST API uses, newest first by `order`
+    cursor = None
+    while True:
+        variables = {'owner': organization, 'name': repository, 'cursor': cursor, 'order': order}
+        response = client.session.post(client.graphql_url, json={'query': pull_requests_query, 'variables': variables})
+        response.raise_for_status()
+        body = response.json()
+
+        if body.get('errors'):
+            message = '; '.join(error.get('message', '') for error in body['errors'])
+            sys.stderr.write('Error querying the Github GraphQL API for %s/%s: %s\n' % (organization, repository, message))
+            raise(Exception(message))
+
+        pull_requests = body['data']['repository']['pullRequests']
+        for node in pull_requests['nodes']:
+            yield {
+                'number': node['number'],
+                'created_at': node['createdAt'],
+                'closed_at': node['closedAt'],
+                'merged_at': node['mergedAt'],
+                'updated_at': node['updatedAt'],
+                'additions': node['additions'],
+                'deletions': node['deletions'],
+            }
+
+        if not pull_requests['pageInfo']['hasNextPage']:
+            break
+        cursor = pull_requests['pageInfo']['endCursor']
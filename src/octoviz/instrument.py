@@ -0,0 +1,106 @@
+import sys, json, time, threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+class Instrumentation:
+    def __init__(self):
+        self.stages = []  # (stage, repository, seconds), in the order they finished
+        self.requests = 0
+        self.bytes = 0
+        self.rate_limit_remaining = {}  # Last remaining budget reported by each server
+        self.counters = {}  # Events worth knowing about that aren't timed, like retries
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, repository=''):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, repository, time.perf_counter() - start)
+
+    def record(self, name, repository, seconds):
+        with self._lock:
+            self.stages.append((name, repository, seconds))
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_response(self, response, *args, **kwargs):
+        # Registered as a requests response hook on every Github session; responses replayed from the ETag store are
+        # free and their bodies never crossed the network, so they are only counted as 'not modified'
+        replayed = getattr(response, 'replayed', False)
+        size = 0 if replayed else len(response.content or b'')
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        with self._lock:
+            if not replayed:
+                self.requests += 1
+                self.bytes += size
+            if remaining is not None:
+                self.rate_limit_remaining[urlparse(response.url).netloc] = int(remaining)
+
+    def totals(self):
+        totals = {}
+        for name, repository, seconds in self.stages:
+            calls, total = totals.get((name, repository), (0, 0.0))
+            totals[(name, repository)] = (calls + 1, total + seconds)
+        return totals
+
+    def summary(self):
+        lines = ['%-22s %-40s %6s %10s' % ('Stage', 'Repository', 'Calls', 'Seconds')]
+        for (name, repository), (calls, seconds) in sorted(self.totals().items(), key=lambda x: (x[0][1], x[0][0])):
+            lines.append('%-22s %-40s %6d %10.3f' % (name, repository or '-', calls, seconds))
+
+        lines.append('')
+        lines.append('API requests: %d, %.2f MB transferred' % (self.requests, self.bytes / 1024 / 1024))
+        for name, amount in sorted(self.counters.items()):
+            lines.append('%s: %d' % (name.capitalize(), amount))
+        for server, remaining in sorted(self.rate_limit_remaining.items()):
+            lines.append('Rate limit remaining on %s: %d' % (server, remaining))
+
+        return '\n'.join(lines) + '\n'
+
+    def trace(self):
+        return {
+            'stages': [{'stage': name, 'repository': repository, 'seconds': seconds} for name, repository, seconds in self.stages],
+            'requests': self.requests,
+            'bytes': self.bytes,
+            'counters': self.counters,
+            'rate_limit_remaining': self.rate_limit_remaining,
+        }
+
+    def mark(self):
+        with self._lock:
+            return len(self.stages), self.requests, self.bytes, dict(self.counters)
+
+    def since(self, mark):
+        # Everything recorded after `mark`, in the shape of trace(), so a worker process can hand its share to the parent
+        stages, requests, size, counters = mark
+        with self._lock:
+            return {
+                'stages': self.stages[stages:],
+                'requests': self.requests - requests,
+                'bytes': self.bytes - size,
+                'counters': {name: amount - counters.get(name, 0) for name, amount in self.counters.items() if amount != counters.get(name, 0)},
+                'rate_limit_remaining': dict(self.rate_limit_remaining),
+            }
+
+    def merge(self, delta):
+        with self._lock:
+            self.stages.extend(delta['stages'])
+            self.requests += delta['requests']
+            self.bytes += delta['bytes']
+            for name, amount in delta['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            self.rate_limit_remaining.update(delta['rate_limit_remaining'])
+
+    def report(self, trace_file=None):
+        sys.stderr.write('\n' + self.summary())
+        if trace_file:
+            with open(trace_file, 'w') as f:
+                json.dump(self.trace(), f, indent=2)
+
+
+instrumentation = Instrumentation()
+stage = instrumentation.stage
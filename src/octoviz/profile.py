@@ -13,7 +13,7 @@ def profile_create_update(args, create):
     done = 'created' if create else 'updated'
 
     if create:
-        profile = { 'name': args.name, 'token': args.token, 'url': args.url }
+        profile = { 'name': args.name, 'token': args.token, 'url': args.url, 'backend': args.backend }
     else:
         profile = load_profile(args.name)
         if args.token:
@@ -22,6 +22,9 @@ def profile_create_update(args, create):
         if args.url is not False:
             profile['url'] = args.url
 
+        if args.backend:
+            profile['backend'] = args.backend
+
     try:
         sys.stdout.write('Attempting to login to Github server to check credentials...\n')
         client = make_github_client(profile)
@@ -0,0 +1,183 @@
+import os, sys, json, time, hashlib, threading
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from octoviz.instrument import instrumentation
+
+class RateLimit:
+    def __init__(self, reserve=50):
+        self.remaining = None
+        self.reset = None
+        self.reserve = reserve  # Requests to keep in hand so the hourly budget is never fully exhausted
+        self._lock = threading.Lock()
+
+    def update(self, response, *args, **kwargs):
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+
+        with self._lock:
+            self.remaining = int(remaining)
+            self.reset = int(reset)
+
+    def exhausted(self):
+        with self._lock:
+            self.remaining = 0  # Whatever the last response said, the server has stopped serving us
+
+    def wait(self):
+        with self._lock:
+            if self.remaining is None:
+                return
+            if self.remaining > self.reserve:
+                self.remaining -= 1  # Account for requests in flight before their headers come back
+                return
+            delay = self.reset - time.time() + 1
+
+        if delay > 0:
+            sys.stderr.write('Github rate limit is running low, waiting %d seconds for it to reset...\n' % delay)
+            time.sleep(delay)
+            instrumentation.record('rate limit wait', '', delay)
+
+        with self._lock:
+            if self.reset is not None and self.reset <= time.time():
+                self.remaining = None  # Budget has been restored, the next response will tell us how much
+
+
+class TokenPool:
+    # Hands each request to whichever of several tokens has the most budget left
+    def __init__(self, shards):
+        self.shards = shards  # (RateLimit, value to hand out) for each token
+        self.assigned = [0] * len(shards)
+        self._lock = threading.Lock()
+
+    def budget(self, index):
+        remaining = self.shards[index][0].remaining
+        return float('inf') if remaining is None else remaining  # Unused tokens haven't told us their budget yet
+
+    def acquire(self):
+        with self._lock:
+            index = max(range(len(self.shards)), key=lambda i: (self.budget(i), -self.assigned[i]))
+            self.assigned[index] += 1
+            return self.shards[index][1]
+
+
+class Scheduler(HTTPAdapter):
+    # Connection pool that paces every API call against the budget of the token making it, retries
+    # failures with exponential backoff and turns unchanged GET responses into free 304s using their ETags
+    retry_statuses = {500, 502, 503, 504}
+
+    def __init__(self, etag_dir=None, retries=5, backoff=1, **kwargs):
+        super().__init__(**kwargs)
+        self.etag_dir = etag_dir
+        self.retries = retries
+        self.backoff = backoff
+        self.limits = {}  # Rate limit budget by Authorization header, so profiles sharing the pool don't share a budget
+        self._lock = threading.Lock()
+
+    def limit_for(self, request):
+        key = request.headers.get('Authorization')
+        with self._lock:
+            if key not in self.limits:
+                self.limits[key] = RateLimit()
+            return self.limits[key]
+
+    def etag_file(self, request):
+        # Only pages of pull request lists are worth keeping: they are requested again on every refresh, while a
+        # single pull request is only fetched again once it has changed, so storing its body would just fill the disk
+        if self.etag_dir is None or request.method != 'GET' or not urlparse(request.url).path.endswith('/pulls'):
+            return None
+        key = hashlib.sha1(('%s %s' % (request.headers.get('Authorization'), request.url)).encode()).hexdigest()
+        return '%s/%s.json' % (self.etag_dir, key)
+
+    def send(self, request, **kwargs):
+        limit = self.limit_for(request)
+        path = self.etag_file(request)
+        stored = read_etag(path)
+        if stored is not None:
+            request.headers['If-None-Match'] = stored['etag']
+
+        attempt = 0
+        while True:
+            limit.wait()
+            try:
+                response = super().send(request, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                if attempt >= self.retries:
+                    raise(e)
+                attempt = self.backoff_wait(attempt, request, str(e))
+                continue
+
+            limit.update(response)
+            if attempt < self.retries and response.status_code in {403, 429} and response.headers.get('X-RateLimit-Remaining') == '0':
+                response.close()
+                limit.exhausted()  # The next wait() sleeps until the budget resets rather than backing off
+                attempt += 1
+                continue
+            if attempt < self.retries and (response.status_code in self.retry_statuses or
+                    response.status_code in {403, 429} and 'Retry-After' in response.headers):
+                response.close()
+                attempt = self.backoff_wait(attempt, request, 'HTTP %d' % response.status_code, response.headers.get('Retry-After'))
+                continue
+            break
+
+        if response.status_code == 304 and stored is not None:
+            touch(path)
+            return replay(response, stored)
+        if path is not None and response.status_code == 200 and response.headers.get('ETag'):
+            write_etag(path, response)
+
+        return response
+
+    def backoff_wait(self, attempt, request, reason, retry_after=None):
+        delay = int(retry_after) if retry_after else self.backoff * 2 ** attempt
+        sys.stderr.write('Request to %s failed (%s), retrying in %d seconds...\n' % (request.url, reason, delay))
+        instrumentation.count('retries')
+        time.sleep(delay)
+
+        return attempt + 1
+
+
+def read_etag(path):
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return None  # Half written by an interrupted run, fetch the page again
+
+
+def write_etag(path, response):
+    stored = {
+        'etag': response.headers['ETag'],
+        'headers': {key: response.headers[key] for key in ['Content-Type', 'Link'] if key in response.headers},
+        'body': response.content.decode(response.encoding or 'utf-8'),
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())  # Thread idents repeat across processes
+    with open(temporary, 'w') as f:
+        json.dump(stored, f)
+    os.replace(temporary, path)  # Other threads and runs only ever see a complete entry
+
+
+def touch(path):
+    try:
+        os.utime(path)  # Still in use, so the last to be evicted when the cache is over its budget
+    except OSError:
+        pass
+
+
+def replay(response, stored):
+    # A 304 doesn't count against the rate limit; hand github3 the body it would have got with a 200
+    response.content  # Release the connection back to the pool
+    response.status_code = 200
+    response.reason = 'OK'
+    response.headers.update(stored['headers'])
+    response.encoding = 'utf-8'
+    response._content = stored['body'].encode('utf-8')
+    response.replayed = True  # The body came from disk, see Instrumentation.record_response
+    instrumentation.count('not modified')
+
+    return response
@@ -1,17 +1,25 @@
-from octoviz.common import clients_from_profiles, octoviz_dir, create_directory, get_raw_pull_data
+from octoviz.common import prepare_clients, octoviz_dir, create_directory, get_raw_pull_data
 from octoviz.graph import data_to_graph_params, graph
+from octoviz.cache import cache_exists, read_cache, write_cache, merge_pull_data, pulls_to_frame, aggregate_key, read_aggregates, write_aggregates
+from octoviz.cache import read_partial, remove_partial, checkpoint_pulls
+from octoviz.store import store_exists, store_file, read_state, read_store, write_store, upsert_store
+from octoviz.budget import maintain_cache
+from octoviz.sketch import build_sketch, merge_sketches, sketch_table
+from octoviz.instrument import instrumentation, stage
 
 from bokeh.plotting import output_file, show
 from bokeh.layouts import gridplot
 
-import os, json, datetime, sys
-import shutil
+import os, datetime, sys
+import shutil, cProfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 
 import arrow
 import pandas as pd
 
 def custom_percentiles(args):
-    return sorted([int(p) for p in args.percentiles.split(',')])
+    return sorted(set([int(p) for p in args.percentiles.split(',')]))
 
 
 def get_rate_limit(args):
@@ -47,186 +55,429 @@ def get_rate_limit(args):
 
 
 
-def run(args):
-    clients_from_profiles()
-    
-    modifier = 0 if args.complete else -1
+def floor_times(times, frame):
+    # Same buckets as arrow's floor: weeks start on Monday, months on the 1st, all in UTC
+    period = 'W' if frame == 'week' else 'M'
+    return times.dt.to_period(period).dt.start_time.dt.tz_localize('UTC')
 
-    rate_limit = get_rate_limit(args)
 
-    stat_percentiles = custom_percentiles(args)
+def build_frame(pull_data, group, frame, round_to):
+    rounded = lambda x: x - (x % round_to)
+
+    dataframe_dict = {
+        'pull number': pull_data['number'],
+        'lifetime': (pull_data['closed_at'] - pull_data['created_at']).dt.total_seconds() / 3600 / 24,
+        'created': floor_times(pull_data['created_at'], frame),  # Necessary to rate-limit data
+    }
+
+    # Optimizing by only doing one of these per request
+    if group == 'closed':
+        dataframe_dict[group] = floor_times(pull_data['closed_at'], frame)
+    elif group == 'additions':
+        dataframe_dict[group] = rounded(pull_data['additions'].values)
+    elif group == 'deletions':
+        dataframe_dict[group] = rounded(pull_data['deletions'].values)
+    elif group == 'total':
+        dataframe_dict[group] = rounded(pull_data['additions'].values + pull_data['deletions'].values)
+
+    return pd.DataFrame(dataframe_dict)
+
+
+def aggregate(grouped, stat_percentiles):
+    # Each group is sorted once for every percentile together, rather than once per percentile
+    table = grouped.quantile([d/100 for d in stat_percentiles]).unstack()
+    table.columns = ['%dth' % d for d in stat_percentiles]
+    table.insert(0, 'count', grouped.count())
+
+    return table.sort_index()
+
+
+def analysis_group(args):
+    group = args.analyze if args.analyze else args.group
+    if group not in {'closed', 'created', 'additions', 'deletions', 'total'}:  # Default to fall back to
+        group = 'closed'
+    return group
+
+
+def aggregate_params(args, rate_limit, stat_percentiles):
+    # Everything that changes the aggregated tables; rendering-only flags are left out on purpose
+    now = arrow.utcnow()
+    params = {
+        'frame': args.frame,
+        'group': analysis_group(args),
+        'round_to': args.round_to,
+        'percentiles': stat_percentiles,
+        'rate_limit': rate_limit,
+        'compare_current': args.compare_current,
+        'compare_last': args.compare_last,
+        'limit_by_months': args.limit_by_months,
+        'now': [now.floor(rate_limit[0][:-1]).isoformat() if rate_limit else None, now.floor(args.frame).isoformat()],
+    }
+    if args.rollup:
+        # Sketches can be read back at any percentile, but the titles built with them name the rollup
+        params.update(percentiles=None, sketch=True, rollup=args.rollup)
+
+    return params
+
+
+def window_start(args, rate_limit):
+    # Earliest creation time aggregate_repository keeps, so a store can skip reading anything older
+    if not rate_limit:
+        return None
+
+    time = rate_limit[0][:-1]
+    if args.compare_current:
+        return arrow.utcnow().shift(**{rate_limit[0]: -1}).floor(time).datetime
+    if args.compare_last:
+        return arrow.utcnow().shift(**{rate_limit[0]: -2}).floor(time).datetime
+
+    shift_time = rate_limit[1] * 4 if args.limit_by_months and args.frame == 'week' else rate_limit[1]
+    return arrow.utcnow().shift(**{rate_limit[0]: shift_time}).floor(time).datetime
 
-    pull_data = []
-    chart_data = []
-    x_axis = None
-    y_axis = None
-    num_prs_y_axis = None
-    stats = lambda group: {'count': group.count(), **{'%dth' % d: group.quantile(d/100) for d in stat_percentiles}}
 
+def load_pull_data(repository, args, rate_limit, windowed=True):
+    # With windowed=False the store is read in full, for callers that keep the data for requests with other windows
     build_cache_flags = args.fetch_no_cache or args.force_build_cache
+    org, repo = repository.split('/') 
+    sqlite = args.store == 'sqlite'
+    exists = store_exists if sqlite else cache_exists
+
+    # Build cache if force or if the cache does not exist
+    if build_cache_flags or not exists(repository):
+        # Pick up from the checkpoint of a build that was interrupted, only fetching what it hadn't collected yet
+        partial = None if args.fetch_no_cache else read_partial(repository, args.full)
+        skip = None if partial is None else set(partial['number'])
+
+        with stage('fetch', repository):
+            pull_data = get_raw_pull_data(org, repo, rate_limit, args.full, workers=args.workers, skip=skip, shard=args.shard_tokens, slices=args.slices)
+            if pull_data is not None and args.fetch_no_cache:
+                pull_data = pulls_to_frame(pull_data)
+            elif pull_data is not None:
+                pull_data = checkpoint_pulls(repository, pull_data, args.full, partial, args.checkpoint)
+                if partial is not None:
+                    pull_data = pull_data.sort_values('created_at', ascending=False).reset_index(drop=True)  # Back in API order
+        if pull_data is None:
+            sys.stderr.write('Could not find repository %s, skipping...\n' % repository)
+            return None
+
+        full = args.full
+
+        if not args.fetch_no_cache:
+            with stage('cache write', repository):
+                if sqlite:
+                    write_store(repository, pull_data, full)
+                else:
+                    write_cache(repository, pull_data, full)
+                remove_partial(repository)
+            
+            if args.no_render:
+                return None
+
+    # Only fetch what changed since the cache was last written, then merge it in
+    elif args.refresh:
+        with stage('cache read', repository):
+            dump = read_state(repository) if sqlite else read_cache(repository)
+        full = dump['full']  # Keep the cache consistent with how it was first built
+
+        with stage('fetch', repository):
+            if dump['watermark'] is None:
+                fetched = get_raw_pull_data(org, repo, rate_limit, full, workers=args.workers, shard=args.shard_tokens, slices=args.slices)
+            else:
+                fetched = get_raw_pull_data(org, repo, rate_limit, full, dump['watermark'], args.workers, shard=args.shard_tokens,
+                    slices=args.slices)
+            if fetched is not None:
+                fetched = pulls_to_frame(fetched)
+        if fetched is None:
+            sys.stderr.write('Could not find repository %s, skipping...\n' % repository)
+            return None
+
+        with stage('cache write', repository):
+            if sqlite:
+                upsert_store(repository, fetched)  # Only the changed rows are written
+            else:
+                pull_data = merge_pull_data(dump['data'], fetched)
+                write_cache(repository, pull_data, full)
 
-    if args.analyze:
-        group = args.analyze
+        if args.no_render:
+            return None
+
+        if sqlite:
+            with stage('cache read', repository):
+                pull_data = read_store(repository, window_start(args, rate_limit) if windowed else None)['data']
+
+    # Read from cache files if they exist and not force-rebuild
     else:
-        group = args.group
+        with stage('cache read', repository):
+            if sqlite:
+                dump = read_store(repository, window_start(args, rate_limit) if windowed else None)  # Only the rows inside the window
+            else:
+                dump = read_cache(repository)
+        pull_data = dump['data']
+        full = dump['full']
 
-    if args.name:
-        file_name = octoviz_dir('html/%s.html' % args.name)
+    return pull_data, full
+
+
+def aggregate_repository(repository, pull_data, full, args, rate_limit, stat_percentiles, frames=None):
+    repo = args.rollup or repository.split('/')[1]  # Titles name the rollup when repositories are combined
+    is_datetime = args.analyze is None
+    group = analysis_group(args)
+
+    if args.analyze and not full:
+        sys.stderr.write('When trying to use line change analyze tool, full-data scrapping is required. Rebuild the cache with --full flag and try again')
+        sys.exit(1)
+
+    # Callers rendering several dashboards from the same data can pass a dict to share frames between them
+    frame_key = (group, args.frame, args.round_to)
+    if frames is not None and frame_key in frames:
+        frame = frames[frame_key]
     else:
-        file_name = octoviz_dir('html/octoviz.html')
-    
-    if not args.force_build_cache == 'no-render':
-        create_directory('html')
-        output_file(file_name)
+        with stage('frame', repository):
+            frame = build_frame(pull_data, group, args.frame, args.round_to)
+        if frames is not None:
+            frames[frame_key] = frame
+
+    if frame.empty:
+        sys.stderr.write('No data to use! Try increasing the rate limit\n')
+        sys.exit(1)
+
+    compare_data = None
+    data = None
+    data_custom_title = None
+    compare_data_custom_title = None
+
+    if rate_limit:
+        time = rate_limit[0][:-1]
+        if args.compare_current:
+            recent_start = arrow.utcnow().floor(time).datetime
+            previous_start = arrow.utcnow().shift(**{rate_limit[0]:-1}).floor(time).datetime
+            data = frame[frame['created'] >= recent_start]
+            compare_data = frame[frame['created'] >= previous_start]
+            compare_data = compare_data[compare_data['created'] < recent_start]
+            data_custom_title = "PR Life for %s PRs Created in %s of %s, By Lines %s" % (repo, time.capitalize(), arrow.get(recent_start).format('MMM DD'), group)
+            compare_data_custom_title = \
+                "PR Life for %s PRs Created in %s of %s, By Lines %s" % (repo, time.capitalize(), arrow.get(previous_start).format('MMM DD'), group)
+        elif args.compare_last:
+            current_start = arrow.utcnow().floor(time).datetime
+            recent_start = arrow.utcnow().shift(**{rate_limit[0]:-1}).floor(time).datetime
+            previous_start = arrow.utcnow().shift(**{rate_limit[0]:-2}).floor(time).datetime
+            data = frame[frame['created'] < current_start]
+            data = data[data['created'] >= recent_start]
+            compare_data = frame[frame['created'] >= previous_start]
+            compare_data = compare_data[compare_data['created'] < recent_start]
+            data_custom_title = "PR Life for %s PRs Created in %s of %s, By Lines %s" % (repo, time.capitalize(), arrow.get(recent_start).format('MMM DD'), group)
+            compare_data_custom_title = \
+                "PR Life for %s PRs Created in %s of %s, By Lines %s" % (repo, time.capitalize(), arrow.get(previous_start).format('MMM DD'), group)
+        else:
+            if args.limit_by_months and args.frame == 'week':
+                shift_time = rate_limit[1] * 4
+            else:
+                shift_time = rate_limit[1]
+            shift = {rate_limit[0]: shift_time}
+            limited = arrow.utcnow().shift(**shift).floor(time)
+            data = frame[frame['created'] >= limited.datetime]
+        if data.empty:
+            sys.stderr.write('No data to show!\n')
+            sys.exit(1)
+        if compare_data is not None and compare_data.empty:
+            sys.stderr.write('No data to show!\n')
+            sys.exit(1)
+    else:
+        data = frame
 
-    for repository in args.repos:
-        org, repo = repository.split('/') 
+    # A rollup keeps a mergeable sketch of each group's lifetimes instead of the percentiles themselves
+    if args.rollup:
+        summarize = lambda data: build_sketch(data['lifetime'], data[group])
+    else:
+        summarize = lambda data: aggregate(data['lifetime'].groupby(data[group]), stat_percentiles)
 
-        # Build cache if force or if the cache does not exist
-        if build_cache_flags or not os.path.exists(octoviz_dir('cache/%s/%s.json' % (org, repo))):
-            create_directory('cache/%s' % org)
+    if is_datetime:
+        compare_data = None  # Comparisons are only rendered for line change analysis
+    else:
+        get_grouped_data = lambda data: data[data[group] < (args.round_to * 50)]
+        data = get_grouped_data(data)
+        if compare_data is not None:
+            compare_data = get_grouped_data(compare_data)
+            with stage('aggregate', repository):
+                compare_data = summarize(compare_data)
+    
+    with stage('aggregate', repository):
+        data = summarize(data)
 
-            pull_data = get_raw_pull_data(org, repo, rate_limit, args.full)
-            if pull_data is None:
-                sys.stderr.write('Could not find repository %s, skipping...\n' % repository)
-                continue
+    return {'group': group, 'data': data, 'compare_data': compare_data, 'titles': [data_custom_title, compare_data_custom_title]}
 
-            full = args.full
 
-            dump = {'full': full, 'data':pull_data}
+def rollup(summaries, stat_percentiles):
+    # Merges the sketches of every repository into the tables aggregate_repository builds for a single one
+    summaries = [summary for summary in summaries if summary is not None]
+    if not summaries:
+        return None
 
-            if not args.fetch_no_cache:
-                with open(octoviz_dir('cache/%s.json' % repository), "w") as f:
-                    json.dump(dump, f)
-                
-                if args.no_render:
-                    continue
+    tables = {}
+    for name in ['data', 'compare_data']:
+        sketches = [summary[name] for summary in summaries if summary[name] is not None]
+        tables[name] = sketch_table(merge_sketches(sketches), stat_percentiles) if sketches else None
 
-        # Read from cache files if they exist and not force-rebuild
-        else:
-            with open(octoviz_dir('cache/%s.json' % repository), "r") as f:
-                dump = json.load(f)
-                pull_data = dump['data']
-                full = dump['full']
+    return {'group': summaries[0]['group'], 'titles': summaries[0]['titles'], **tables}
 
-        rounded = lambda x: x - (x % args.round_to)
-        frame_data = lambda func: list(map(func, pull_data))
-        is_datetime = args.analyze is None
 
-        if args.analyze and not full:
-            sys.stderr.write('When trying to use line change analyze tool, full-data scrapping is required. Rebuild the cache with --full flag and try again')
-            sys.exit(1)
-        
-        # Optimizing by only doing one of these per request
-        if group == 'closed':
-            framed_data = frame_data(lambda x: arrow.get(x['closed_at']).floor(args.frame).datetime)
-        elif group == 'additions':
-            framed_data = frame_data(lambda x: rounded(x['additions']))
-        elif group == 'deletions':
-            framed_data = frame_data(lambda x: rounded(x['deletions']))
-        elif group == 'total':
-            framed_data = frame_data(lambda x: rounded(x['additions'] + x['deletions']))
-        elif group == 'created':
-            pass
-        else:  # Default to fall back to
-            group = 'closed'
-            framed_data = frame_data(lambda x: arrow.get(x['closed_at']).floor(args.frame).datetime)
-
-        # Build pandas frame
-        dataframe_dict = {
-            'pull number': frame_data(lambda x: x['number']),
-            'lifetime': frame_data(lambda x: (arrow.get(x['closed_at']) - arrow.get(x['created_at'])).total_seconds()/3600/24),
-            'created': frame_data(lambda x: arrow.get(x['created_at']).floor(args.frame).datetime),  # Necessary to rate-limit data
-        }
-        
-        if group != 'created':
-            dataframe_dict[group] = framed_data
-        
-        frame = pd.DataFrame(dataframe_dict)
-
-        if frame.empty:
-            sys.stderr.write('No data to use! Try increasing the rate limit\n')
-            sys.exit(1)
+def chart_params(aggregates, args):
+    is_datetime = args.analyze is None
+    group = aggregates['group']
+    data_custom_title, compare_data_custom_title = aggregates['titles']
 
-        compare_data = None
-        data = None
-        data_custom_title = None
-        compare_data_custom_title = None
-
-        if rate_limit:
-            time = rate_limit[0][:-1]
-            if args.compare_current:
-                recent_start = arrow.utcnow().floor(time).datetime
-                previous_start = arrow.utcnow().shift(**{rate_limit[0]:-1}).floor(time).datetime
-                data = frame[frame['created'] >= recent_start]
-                compare_data = frame[frame['created'] >= previous_start]
-                compare_data = compare_data[compare_data['created'] < recent_start]
-                data_custom_title = "PR Life for %s PRs Created in %s of %s, By Lines %s" % (repo, time.capitalize(), arrow.get(recent_start).format('MMM DD'), group)
-                compare_data_custom_title = \
-                    "PR Life for %s PRs Created in %s of %s, By Lines %s" % (repo, time.capitalize(), arrow.get(previous_start).format('MMM DD'), group)
-            elif args.compare_last:
-                current_start = arrow.utcnow().floor(time).datetime
-                recent_start = arrow.utcnow().shift(**{rate_limit[0]:-1}).floor(time).datetime
-                previous_start = arrow.utcnow().shift(**{rate_limit[0]:-2}).floor(time).datetime
-                data = frame[frame['created'] < current_start]
-                data = data[data['created'] >= recent_start]
-                compare_data = frame[frame['created'] >= previous_start]
-                compare_data = compare_data[compare_data['created'] < recent_start]
-                data_custom_title = "PR Life for %s PRs Created in %s of %s, By Lines %s" % (repo, time.capitalize(), arrow.get(recent_start).format('MMM DD'), group)
-                compare_data_custom_title = \
-                    "PR Life for %s PRs Created in %s of %s, By Lines %s" % (repo, time.capitalize(), arrow.get(previous_start).format('MMM DD'), group)
-            else:
-                if args.limit_by_months and args.frame == 'week':
-                    shift_time = rate_limit[1] * 4
-                else:
-                    shift_time = rate_limit[1]
-                shift = {rate_limit[0]: shift_time}
-                limited = arrow.utcnow().shift(**shift).floor(time)
-                data = frame[frame['created'] >= limited.datetime]
-            if data.empty:
-                sys.stderr.write('No data to show!\n')
-                sys.exit(1)
-            if compare_data is not None and compare_data.empty:
-                sys.stderr.write('No data to show!\n')
-                sys.exit(1)
-        else:
-            data = frame
+    if is_datetime:
+        bar_width = (arrow.now().ceil(args.frame) - arrow.now().floor(args.frame)).total_seconds() * 800
+    else:
+        bar_width = args.round_to
 
-        if is_datetime:
-            bar_width = (arrow.now().ceil(args.frame) - arrow.now().floor(args.frame)).total_seconds() * 800
-            data = data['lifetime'].groupby(data[group])
-        else:
-            bar_width = args.round_to
-            get_grouped_data = lambda data: data[data[group] < (args.round_to * 50)]['lifetime'].groupby(data[group])
-            data = get_grouped_data(data)
-            if compare_data is not None:
-                compare_data = get_grouped_data(compare_data)
-                compare_data = compare_data.apply(stats).unstack().to_dict()
-        
-        data = data.apply(stats).unstack().to_dict()
-
-        get_graph_params = lambda data: data_to_graph_params(data, bar_width, {'count': 'PRs Completed'}, is_datetime, args.round_to, args.complete)
-        line, bar = get_graph_params(data)
+    get_graph_params = lambda data: data_to_graph_params(data, bar_width, {'count': 'PRs Completed'}, is_datetime, args.round_to, args.complete, args.max_points)
+    line, bar = get_graph_params(aggregates['data'])
+    
+    if not is_datetime:
+        bar['count']['x'] = bar['count']['x'] + args.round_to/2  # Offset the bar x location for line analysis graphs
     
-        if not is_datetime:
-            bar['count']['x'] = list(map(lambda x: x + args.round_to/2, bar['count']['x']))  # Offset the bar x location for line analysis graphs
-        
-        chart_data.append(graph(line, bar, repo, args.frame, group, x_axis, y_axis, num_prs_y_axis, is_datetime, data_custom_title))
+    charts = [(line, bar, group, data_custom_title)]
+
+    if aggregates['compare_data'] is not None:
+        line, bar = get_graph_params(aggregates['compare_data'])
+        bar['count']['x'] = bar['count']['x'] + args.round_to/2
+        charts.append((line, bar, group, compare_data_custom_title))
 
-        if args.link_x:
-            x_axis = chart_data[-1][0].x_range
-        if args.link_y:
-            y_axis = chart_data[-1][0].y_range
-            num_prs_y_axis = chart_data[-1][1].y_range
+    return charts
+
+
+def process_repository(repository, args, rate_limit, stat_percentiles):
+    # Cached data that is neither rebuilt nor refreshed can reuse aggregates from an earlier run with the same parameters
+    sqlite = args.store == 'sqlite'
+    exists = store_exists if sqlite else cache_exists
+    use_aggregates = not (args.fetch_no_cache or args.force_build_cache or args.refresh) and exists(repository)
+    # Sketches for a rollup are merged once every repository is done, charts are drawn from each repository's own tables
+    summarize = (lambda aggregates: aggregates) if args.rollup else (lambda aggregates: chart_params(aggregates, args))
+
+    if use_aggregates:
+        with stage('cache read', repository):
+            version = read_state(repository)['version'] if sqlite else None
+            key = aggregate_key(repository, aggregate_params(args, rate_limit, stat_percentiles), version)
+            aggregates = read_aggregates(repository, key)
+        if aggregates is not None:
+            return summarize(aggregates)
+
+    loaded = load_pull_data(repository, args, rate_limit)
+    if loaded is None:
+        return None if args.rollup else []
+
+    pull_data, full = loaded
+    aggregates = aggregate_repository(repository, pull_data, full, args, rate_limit, stat_percentiles)
+
+    if use_aggregates:
+        with stage('cache write', repository):
+            write_aggregates(repository, key, aggregates)
+
+    return summarize(aggregates)
+
+
+def process_in_worker(repository, args, rate_limit, stat_percentiles):
+    # Runs in a worker process; what it recorded is handed back with the charts so --profile still covers it
+    mark = instrumentation.mark()
+    charts = process_repository(repository, args, rate_limit, stat_percentiles)
+    return charts, instrumentation.since(mark)
+
+
+def run(args):
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler is not None:
+        profiler.enable()
 
-        if compare_data:
-            line, bar = get_graph_params(compare_data)
-            bar['count']['x'] = list(map(lambda x: x + args.round_to/2, bar['count']['x']))
-            chart_data.append(graph(line, bar, repo, args.frame, group, x_axis, y_axis, num_prs_y_axis, is_datetime, compare_data_custom_title))
+    try:
+        with stage('total'):
+            render_dashboard(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        if args.profile:
+            instrumentation.report(args.profile_trace)
 
 
+def render_dashboard(args):
+    with stage('profiles'):
+        prepare_clients(args.pool_size or max(10, args.workers * args.jobs), not args.fetch_no_cache)
+
+    rate_limit = get_rate_limit(args)
+
+    stat_percentiles = custom_percentiles(args)
+
+    if args.name:
+        file_name = octoviz_dir('html/%s.html' % args.name)
+    else:
+        file_name = octoviz_dir('html/octoviz.html')
+    
+    if not args.force_build_cache == 'no-render':
+        create_directory('html')
+        output_file(file_name, mode=args.resources)
+
+    exists = store_exists if args.store == 'sqlite' else cache_exists
+    hits = {repository: not (args.fetch_no_cache or args.force_build_cache) and exists(repository) for repository in args.repos}
+
+    process = lambda repository: process_repository(repository, args, rate_limit, stat_percentiles)
+
+    if args.processes > 1:
+        # Loading and aggregating is CPU bound, so spread repositories over processes and only ship the tables back
+        worker = partial(process_in_worker, args=args, rate_limit=rate_limit, stat_percentiles=stat_percentiles)
+        pool_size = args.pool_size or max(10, args.workers)
+        with ProcessPoolExecutor(max_workers=args.processes, initializer=prepare_clients, initargs=(pool_size, not args.fetch_no_cache)) as executor:
+            results = []
+            for charts, delta in executor.map(worker, args.repos):
+                instrumentation.merge(delta)
+                results.append(charts)
+    elif args.jobs > 1:
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(process, args.repos))  # Keeps the order repositories were given in
+    else:
+        results = map(process, args.repos)
+
+    if args.rollup:
+        with stage('rollup'):
+            aggregates = rollup(results, stat_percentiles)
+        layout = build_layout([(args.rollup, chart_params(aggregates, args))] if aggregates is not None else [], args)
+    else:
+        layout = build_layout(zip(args.repos, results), args)
+
+    if not (args.cleanup or args.fetch_no_cache):
+        with stage('cache maintenance'):
+            maintain_cache(args.repos, hits, args.store, args.cache_budget, args.retention)
+
     if args.cleanup:
         shutil.rmtree(octoviz_dir('cache'), ignore_errors=True)
+        for path in [store_file(), store_file() + '-wal', store_file() + '-shm']:
+            if os.path.exists(path):
+                os.remove(path)
+
+    if not args.no_render and layout is not None:
+        with stage('render'):
+            show(layout)
 
-    if not args.no_render and len(chart_data) > 0:
-        show(gridplot(chart_data))
\ No newline at end of file
+
+def build_layout(results, args):
+    # Takes (repository, chart params) pairs and lays out their figures, or returns None when there is nothing to show
+    chart_data = []
+    x_axis = None
+    y_axis = None
+    num_prs_y_axis = None
+    is_datetime = args.analyze is None
+
+    # Figures are built in order so that linked axes behave the same as when fetching one repository at a time
+    for repository, charts in results:
+        repo = repository.split('/')[-1]
+        for line, bar, group, custom_title in charts:
+            with stage('graph', repository):
+                chart_data.append(graph(line, bar, repo, args.frame, group, x_axis, y_axis, num_prs_y_axis, is_datetime, custom_title, args.webgl))
+
+            if args.link_x:
+                x_axis = chart_data[-1][0].x_range
+            if args.link_y:
+                y_axis = chart_data[-1][0].y_range
+                num_prs_y_axis = chart_data[-1][1].y_range
+
+    return gridplot(chart_data) if chart_data else None
\ No newline at end of file
@@ -0,0 +1,187 @@
+import sys, json, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from bokeh.embed import file_html
+from bokeh.resources import Resources
+
+from octoviz.common import prepare_clients
+from octoviz.config import configuration
+from octoviz.run import get_rate_limit, custom_percentiles, load_pull_data, aggregate_repository, aggregate_params, chart_params, rollup, build_layout
+
+usage = '''OctoViz dashboards are requested with the flags of `octoviz run` as query arguments, for example:
+
+    /?repo=org_name/repo_name&repo=org_name/other_repo&month&analyze-by=total&x
+
+Each `repo` is a repository to graph, `name=value` becomes `--name value`, a bare `name` becomes `--name`,
+and single letter names become short flags (`x` is `-x`).
+'''
+
+
+class Dashboards:
+    # Pull request data and aggregated tables kept in memory, so a request only pays for what changed
+    def __init__(self, full=False, store='npz', workers=8):
+        self.parser = configuration()
+        self.full = full
+        self.store = store
+        self.workers = workers
+        self.pull_data = {}  # (pull data, full) by repository
+        self.frames = {}  # Analysis frames built from each repository's data, shared by every dashboard using them
+        self.aggregates = {}  # Aggregated tables by repository and the parameters that produced them
+        self.pages = {}  # Rendered HTML by request, building the Bokeh document is most of the cost of a render
+        self.locks = {}
+        self._lock = threading.Lock()
+
+    def run_args(self, argv):
+        args = self.parser.parse_args(['run'] + argv)
+        # Requests only ever read what the server holds, fetching is left to the background refresh
+        args.force_build_cache = args.fetch_no_cache = args.refresh = args.no_render = False
+        args.store = self.store
+        args.workers = self.workers  # How the server was started, `run` defaults would apply otherwise
+        args.full = args.full or self.full  # Caches that don't exist yet are built the way the server was started with
+        return args
+
+    def lock_for(self, repository):
+        with self._lock:
+            return self.locks.setdefault(repository, threading.Lock())
+
+    def load(self, repository, args):
+        with self.lock_for(repository):
+            if repository not in self.pull_data:
+                # Built from Github if not cached yet. Kept for every later request, so never just one request's window
+                loaded = load_pull_data(repository, args, get_rate_limit(args), windowed=False)
+                if loaded is None:
+                    return None
+                self.pull_data[repository] = loaded
+                self.frames[repository] = {}
+            return self.pull_data[repository]
+
+    def refresh(self, repository):
+        args = self.run_args(['--no-limit', repository])
+        args.refresh = True
+        loaded = load_pull_data(repository, args, None)
+        if loaded is None:
+            return
+
+        with self.lock_for(repository):
+            self.pull_data[repository] = loaded
+            self.frames[repository] = {}
+            with self._lock:
+                for key in [key for key in self.aggregates if key[0] == repository]:
+                    del self.aggregates[key]
+                self.pages.clear()
+
+    def refresh_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            for repository in list(self.pull_data):
+                try:
+                    self.refresh(repository)
+                except Exception as e:
+                    sys.stderr.write('Error refreshing %s, keeping the data already loaded: %s\n' % (repository, e))
+
+    def render(self, argv):
+        args = self.run_args(argv)
+        rate_limit = get_rate_limit(args)
+        stat_percentiles = custom_percentiles(args)
+        key = json.dumps(aggregate_params(args, rate_limit, stat_percentiles), sort_keys=True)
+        page = (key, json.dumps({name: value for name, value in vars(args).items() if name != 'func'}, sort_keys=True))
+
+        with self._lock:
+            if page in self.pages:
+                return self.pages[page]
+
+        results = []
+        for repository in args.repos:
+            loaded = self.load(repository, args)
+            if loaded is None:
+                continue
+
+            with self._lock:
+                aggregates = self.aggregates.get((repository, key))
+            if aggregates is None:
+                aggregates = aggregate_repository(repository, *loaded, args, rate_limit, stat_percentiles, self.frames[repository])
+                with self._lock:
+                    self.aggregates[(repository, key)] = aggregates
+            results.append((repository, aggregates if args.rollup else chart_params(aggregates, args)))
+
+        complete = len(results) == len(args.repos)
+        if args.rollup:
+            aggregates = rollup([summary for _, summary in results], stat_percentiles)
+            results = [(args.rollup, chart_params(aggregates, args))] if aggregates is not None else []
+
+        layout = build_layout(results, args)
+        if layout is None:
+            return None
+
+        html = file_html(layout, Resources(mode=args.resources), 'OctoViz')
+        if complete:
+            with self._lock:
+                self.pages[page] = html  # Not when a repository is missing, it may turn up on the next request
+        return html
+
+
+def query_to_argv(query):
+    argv = []
+    for name, values in parse_qs(query, keep_blank_values=True).items():
+        for value in values:
+            if name == 'repo':
+                argv.append(value)
+                continue
+            argv.append('-%s' % name if len(name) == 1 else '--%s' % name)
+            if value:
+                argv.append(value)
+
+    return argv
+
+
+def handler(dashboards):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/':
+                return self.respond(404, 'Not found\n')
+            if 'repo' not in parse_qs(url.query):
+                return self.respond(400, usage)
+
+            try:
+                html = dashboards.render(query_to_argv(url.query))
+            except SystemExit:
+                return self.respond(400, 'Invalid dashboard parameters, see the server output for details\n\n' + usage)
+            except Exception as e:
+                sys.stderr.write('Error rendering %s: %s\n' % (self.path, e))
+                return self.respond(500, 'Error rendering dashboard: %s\n' % e)
+
+            if html is None:
+                return self.respond(404, 'No data to show for these repositories\n')
+            self.respond(200, html, 'text/html')
+
+        def respond(self, status, body, content_type='text/plain'):
+            payload = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', '%s; charset=utf-8' % content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+
+def serve(args):
+    prepare_clients(args.pool_size or max(10, args.workers))
+    dashboards = Dashboards(args.full, args.store, args.workers)
+
+    for repository in args.repos:
+        sys.stdout.write('Loading %s...\n' % repository)
+        dashboards.load(repository, dashboards.run_args([repository]))
+
+    threading.Thread(target=dashboards.refresh_forever, args=(args.refresh_every * 60,), daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), handler(dashboards))
+    sys.stdout.write('Serving OctoViz dashboards on http://%s:%d/\n' % (args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
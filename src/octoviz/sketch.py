@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+# Lifetimes are counted in logarithmically sized bins (as in DDSketch), so any percentile read back is within
+# `relative_accuracy` of the true lifetime, and merging the sketches of several repositories is just adding counts
+relative_accuracy = 0.01
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+log_gamma = np.log(gamma)
+min_lifetime = 1 / 24 / 3600  # A second, in days; anything quicker is counted as closing instantly
+zero_bin = int(np.floor(np.log(min_lifetime) / log_gamma)) - 1
+
+
+def bin_values(bins):
+    values = 2 * gamma ** np.asarray(bins, dtype='float64') / (gamma + 1)
+    values[np.asarray(bins) == zero_bin] = 0
+
+    return values
+
+
+def build_sketch(lifetimes, keys):
+    # One row per group and one column per bin holding how many lifetimes of that group fell in it
+    values = lifetimes.values
+    kept = ~np.isnan(values)
+    values = values[kept]
+
+    bins = np.full(len(values), zero_bin, dtype='int64')
+    quick = values <= min_lifetime
+    bins[~quick] = np.ceil(np.log(values[~quick]) / log_gamma)
+
+    counts = pd.DataFrame({'key': keys.array[kept], 'bin': bins}).groupby(['key', 'bin']).size()  # .array keeps the time zone
+    sketch = counts.unstack(fill_value=0)
+    sketch.index.name = keys.name
+    sketch.columns.name = None
+
+    return sketch
+
+
+def merge_sketches(sketches):
+    # Adds every sketch into one table covering all of their groups and bins
+    bins = [sketch.columns.astype('int64') for sketch in sketches]  # Sketches read back from the cache have their bins as strings
+    index = sketches[0].index
+    for sketch in sketches[1:]:
+        index = index.union(sketch.index)
+    columns = pd.Index(np.unique(np.concatenate([sketch_bins.values for sketch_bins in bins])))
+
+    merged = np.zeros((len(index), len(columns)), dtype='int64')
+    for sketch, sketch_bins in zip(sketches, bins):
+        merged[np.ix_(index.get_indexer(sketch.index), columns.get_indexer(sketch_bins))] += sketch.values
+
+    return pd.DataFrame(merged, index=index, columns=columns)
+
+
+def sketch_table(sketch, stat_percentiles):
+    # The same table `aggregate` builds from the raw lifetimes: a count and one column per percentile
+    counts = sketch.values
+    totals = counts.sum(axis=1)
+    cumulative = counts.cumsum(axis=1)
+    values = bin_values(sketch.columns)
+
+    table = pd.DataFrame({'count': totals}, index=sketch.index)
+    for percentile in stat_percentiles:
+        # Interpolated between the two closest order statistics, as pandas' quantile does with the raw lifetimes
+        rank = percentile / 100 * (totals - 1)
+        lower = values[np.minimum((cumulative <= np.floor(rank)[:, None]).sum(axis=1), len(values) - 1)]
+        upper = values[np.minimum((cumulative <= np.ceil(rank)[:, None]).sum(axis=1), len(values) - 1)]
+        table['%dth' % percentile] = lower + (upper - lower) * (rank - np.floor(rank))
+
+    return table
@@ -0,0 +1,186 @@
+import os, sqlite3, shutil
+import numpy as np
+import pandas as pd
+from octoviz.common import octoviz_dir
+from octoviz.cache import column_types, time_columns, line_columns, aggregates_dir
+
+store_file = lambda: octoviz_dir('octoviz.db')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS repositories (
+    repository TEXT PRIMARY KEY,
+    full INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pulls (
+    repository TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    created_at INTEGER,
+    closed_at INTEGER,
+    updated_at INTEGER,
+    additions INTEGER NOT NULL,
+    deletions INTEGER NOT NULL,
+    PRIMARY KEY (repository, number)
+);
+CREATE INDEX IF NOT EXISTS pulls_created ON pulls (repository, created_at);
+CREATE INDEX IF NOT EXISTS pulls_closed ON pulls (repository, closed_at);
+CREATE INDEX IF NOT EXISTS pulls_updated ON pulls (repository, updated_at);
+'''
+
+# Times are stored as seconds since the epoch, so windows are plain integer range scans on the indexes
+columns = list(column_types)
+missing_time = np.iinfo('int64').min  # How numpy represents NaT
+upsert = '''
+INSERT INTO pulls (repository, %s) VALUES (?, %s)
+ON CONFLICT (repository, number) DO UPDATE SET %s
+''' % (', '.join(columns), ', '.join('?' * len(columns)), ', '.join('%s = excluded.%s' % (column, column) for column in columns[1:]))
+
+
+def connect():
+    connection = sqlite3.connect(store_file(), timeout=60)  # Repositories fetched in parallel take turns writing
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.executescript(schema)
+    return connection
+
+
+def store_exists(repository):
+    if not os.path.exists(store_file()):
+        return False
+
+    connection = connect()
+    try:
+        return connection.execute('SELECT 1 FROM repositories WHERE repository = ?', (repository,)).fetchone() is not None
+    finally:
+        connection.close()
+
+
+def seconds(times):
+    values = times.values.astype('datetime64[s]').astype('int64')
+    return [None if value == missing_time else value for value in values.tolist()]
+
+
+def rows(repository, pull_data):
+    values = [pull_data['number'].values.tolist()]
+    values += [seconds(pull_data[column]) for column in time_columns]
+    values += [pull_data[column].values.tolist() for column in line_columns]
+
+    return ((repository, *row) for row in zip(*values))
+
+
+def store_state(repository, connection):
+    full, version = connection.execute('SELECT full, version FROM repositories WHERE repository = ?', (repository,)).fetchone()
+    updated = connection.execute('SELECT MAX(updated_at) FROM pulls WHERE repository = ?', (repository,)).fetchone()[0]
+    if updated is None:
+        return {'full': bool(full), 'version': version, 'watermark': None}
+
+    closed = connection.execute('SELECT MAX(closed_at) FROM pulls WHERE repository = ?', (repository,)).fetchone()[0]
+    numbers = connection.execute('SELECT number FROM pulls WHERE repository = ? AND updated_at = ?', (repository, updated)).fetchall()
+    timestamp = lambda x: pd.Timestamp(x, unit='s').strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    # Same high-water mark as the file cache keeps
+    watermark = {'closed_at': timestamp(closed), 'updated_at': timestamp(updated), 'numbers': [number for number, in numbers]}
+    return {'full': bool(full), 'version': version, 'watermark': watermark}
+
+
+def read_store(repository, since=None):
+    # Only the pull requests created at or after `since`, when given, are read from disk
+    connection = connect()
+    try:
+        state = store_state(repository, connection)
+        query = 'SELECT %s FROM pulls WHERE repository = ?' % ', '.join(columns)
+        params = [repository]
+        if since is not None:
+            query += ' AND created_at >= ?'
+            params.append(int(since.timestamp()))
+        fetched = connection.execute(query + ' ORDER BY created_at DESC', params).fetchall()
+    finally:
+        connection.close()
+
+    values = list(zip(*fetched)) or [()] * len(columns)
+    pull_data = {}
+    for column, value in zip(columns, values):
+        if column in time_columns:
+            pull_data[column] = np.array([missing_time if x is None else x for x in value], dtype='int64').view('datetime64[s]')
+        else:
+            pull_data[column] = np.array(value, dtype=column_types[column])
+
+    return {'full': state['full'], 'data': pd.DataFrame(pull_data), 'watermark': state['watermark']}
+
+
+def write_store(repository, pull_data, full):
+    # Replaces everything stored for the repository, like rebuilding its cache file
+    connection = connect()
+    try:
+        with connection:
+            connection.execute('DELETE FROM pulls WHERE repository = ?', (repository,))
+            connection.executemany(upsert, rows(repository, pull_data))
+            connection.execute('INSERT INTO repositories (repository, full, version) VALUES (?, ?, 1) '
+                'ON CONFLICT (repository) DO UPDATE SET full = excluded.full, version = version + 1', (repository, int(full)))
+    finally:
+        connection.close()
+
+    shutil.rmtree(aggregates_dir(repository), ignore_errors=True)
+
+
+def upsert_store(repository, pull_data):
+    # Adds new pull requests and overwrites the ones that changed, leaving the rest of the history alone
+    connection = connect()
+    try:
+        with connection:
+            connection.executemany(upsert, rows(repository, pull_data))
+            connection.execute('UPDATE repositories SET version = version + 1 WHERE repository = ?', (repository,))
+    finally:
+        connection.close()
+
+    shutil.rmtree(aggregates_dir(repository), ignore_errors=True)
+
+
+def read_state(repository):
+    connection = connect()
+    try:
+        return store_state(repository, connection)
+    finally:
+        connection.close()
+
+
+def trim_store(repository, before):
+    # Deletes the pull requests created before `before` (seconds since the epoch), returning how many there were
+    connection = connect()
+    try:
+        with connection:
+            dropped = connection.execute('DELETE FROM pulls WHERE repository = ? AND created_at < ?', (repository, int(before))).rowcount
+            if dropped:
+                connection.execute('UPDATE repositories SET version = version + 1 WHERE repository = ?', (repository,))
+    finally:
+        connection.close()
+
+    if dropped:
+        shutil.rmtree(aggregates_dir(repository), ignore_errors=True)
+    return dropped
+
+
+def stored_repositories():
+    connection = connect()
+    try:
+        return [repository for repository, in connection.execute('SELECT repository FROM repositories')]
+    finally:
+        connection.close()
+
+
+def vacuum_store():
+    connection = connect()
+    try:
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.execute('VACUUM')
+    finally:
+        connection.close()
+
+
+def remove_store(repository):
+    connection = connect()
+    try:
+        with connection:
+            connection.execute('DELETE FROM pulls WHERE repository = ?', (repository,))
+            connection.execute('DELETE FROM repositories WHERE repository = ?', (repository,))
+    finally:
+        connection.close()